@@ -6,9 +6,14 @@ from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from alembic import context
-sys.path.append(str(Path(__file__).resolve().parents[1]))
-from database import Base, DATABASE_URL
-import models
+from dotenv import load_dotenv
+
+# `backend` is imported as a package (its modules use relative imports), from the `apps` directory.
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+# Same .env file as the web app, so that the CLI migrates the database the app uses.
+load_dotenv(Path(__file__).resolve().parents[1] / ".env")
+from backend.database import Base, DATABASE_URL
+from backend import models
 
 
 # this is the Alembic Config object, which provides
@@ -16,9 +21,10 @@ import models
 config = context.config
 
 # Interpret the config file for Python logging.
-config.set_main_option("sqlalchemy.url", DATABASE_URL)
-# This line sets up loggers basically.
-if config.config_file_name is not None:
+# "%" is escaped for the ini interpolation (e.g. URL-encoded passwords).
+config.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
+# This line sets up loggers basically; not when run from the app (`database.run_migrations`).
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
     fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
@@ -0,0 +1,39 @@
+"""Default created_at to the insert time
+
+Revision ID: 5c1e9a7b3d20
+Revises: 04a8d68649e9
+Create Date: 2026-10-16 10:12:41.208531
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e9a7b3d20'
+down_revision: Union[str, Sequence[str], None] = '04a8d68649e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # models.User declares server_default=func.now(); the initial migration did not,
+    # so users created on a migrated database had no created_at.
+    op.execute(sa.text("UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"))
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('created_at',
+                   existing_type=sa.DateTime(),
+                   server_default=sa.func.now(),
+                   existing_nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('created_at',
+                   existing_type=sa.DateTime(),
+                   server_default=None,
+                   existing_nullable=True)
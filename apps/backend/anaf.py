@@ -1,24 +1,236 @@
+import os
+import asyncio
 import datetime
 import logging
-from difflib import SequenceMatcher
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional, Tuple
 
-from zeep import Client
 from zeep.exceptions import Fault
 
+from .clients import get_clients
+from .anaf_registry import get_company_registry, normalize_cui
+from .shopping_agent.company_names import NameIndex, name_similarity
+from .shopping_agent.cache import TTLCache, create_cache_backend
+from .shopping_agent.concurrency import run_blocking
+from .shopping_agent.resilience import call_upstream, call_upstream_blocking, CircuitOpenError
+
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# The WSDL URL for the v9 ANAF web service
-WSDL_URL = "https://webservicesp.anaf.ro/PlatitorTvaRest/api/v9/ws?wsdl"
+# --- ANAF Service Configuration ---
+# The wsPlatitorTva service accepts up to 100 CUIs per request and about one request per second.
+ANAF_BATCH_SIZE = int(os.getenv("ANAF_BATCH_SIZE", "100"))
+ANAF_MIN_REQUEST_INTERVAL = float(os.getenv("ANAF_MIN_REQUEST_INTERVAL", "1"))
+# Lookups arriving within this many seconds of each other are sent in the same request.
+ANAF_BATCH_WINDOW = float(os.getenv("ANAF_BATCH_WINDOW", "0.2"))
+# Company records rarely change; CUIs unknown to ANAF are checked again sooner.
+ANAF_RECORD_TTL = float(os.getenv("ANAF_RECORD_TTL", str(7 * 24 * 3600)))  # 7 days
+ANAF_MISSING_TTL = float(os.getenv("ANAF_MISSING_TTL", str(24 * 3600)))  # 1 day
+company_cache = TTLCache("anaf_company", create_cache_backend("anaf_companies"), ttl=ANAF_RECORD_TTL)
+missing_cache = TTLCache("anaf_missing", create_cache_backend("anaf_missing_cuis"), ttl=ANAF_MISSING_TTL)
+
+def _company_record(company_data) -> Dict[str, Any]:
+    """The details returned to callers, built from one `found` entry of the ANAF response."""
+    record = {
+        "cui": company_data.date_generale.cui,
+        "name": company_data.date_generale.denumire,
+        "address": company_data.date_generale.adresa,
+        "phone": company_data.date_generale.telefon,
+        "vat_registered": company_data.date_generale.scpTVA,
+        "status": {
+            "vat_active_from": company_data.inregistrare_scop_Tva.d_inceput_ScpTVA,
+            "vat_inactive": company_data.stare_inregistrare_scop_TVA.stare_inactivare,
+            "reactivation_date": company_data.stare_inregistrare_scop_TVA.d_reactivare_TVA,
+            "cancellation_date": company_data.stare_inregistrare_scop_TVA.d_anulare_TVA,
+        }
+    }
+    return _json_safe(record)
+
+def _json_safe(value):
+    """Converts the zeep values (dates, decimals) so that records can be cached as JSON."""
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def _request_payload(cuis: List[str]) -> List[Dict[str, Any]]:
+    current_date = datetime.date.today().strftime("%Y-%m-%d")
+    return [{"cui": int(cui), "data": current_date} for cui in cuis]
+
+def _store_response(cuis: List[str], response) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Caches the records of a response, refreshes them in the local registry
+    and returns them by CUI (None for the CUIs not found).
+    """
+    records: Dict[str, Optional[Dict[str, Any]]] = {cui: None for cui in cuis}
+    for company_data in (response.found or []) if response else []:
+        record = _company_record(company_data)
+        cui = normalize_cui(record["cui"])
+        records[cui] = record
+        company_cache.set(cui, record)
+    for cui, record in records.items():
+        if record is None:
+            missing_cache.set(cui, True)
+    get_company_registry().upsert([record for record in records.values() if record is not None])
+    return records
+
+def cached_record(cui: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    (known, record) from the local registry (rows younger than ANAF_REGISTRY_MAX_AGE) or the caches;
+    `known` is False when ANAF must be asked.
+    """
+    record = get_company_registry().get(cui)
+    if record is not None:
+        return True, record
+    record = company_cache.get(cui)
+    if record is not None:
+        return True, record
+    if missing_cache.get(cui) is not None:
+        return True, None
+    return False, None
+
+def stale_record(cui: str, error: Exception) -> Optional[Dict[str, Any]]:
+    """The registry row of a CUI, whatever its age, used when the live service fails."""
+    record = get_company_registry().get(cui, max_age=None)
+    if record is not None:
+        logger.warning(f"ANAF lookup of CUI {cui} failed ({error}); using the registry row instead.")
+    return record
+
+def names_match(anaf_name: str, expected_name: str, threshold: float) -> bool:
+    """
+    Compares the name from ANAF with the expected name, ignoring legal forms,
+    diacritics, punctuation and word order (see `shopping_agent/company_names.py`).
+    """
+    similarity = name_similarity(anaf_name, expected_name)
+    if similarity < threshold:
+        logger.warning(f"Name mismatch: ANAF: '{anaf_name}', Expected: '{expected_name}', Similarity: {similarity:.2f}")
+        return False
+    return True
+
+def reconcile_names(names: List[str], records: List[Dict[str, Any]], threshold: float = 0.6) -> List[Optional[Dict[str, Any]]]:
+    """
+    Matches each name (e.g. of a Places result set) to the ANAF record with the closest
+    company name, or None when no record reaches the threshold. The records' names are
+    indexed once, so every name is scored against all of them in one pass.
+    """
+    index = NameIndex([record["name"] or "" for record in records])
+    return [records[i] if i >= 0 else None for i, _ in index.match_all(names, threshold)]
+
+class AnafVerificationService:
+    """
+    Async ANAF lookups. Concurrent lookups are queued for up to ANAF_BATCH_WINDOW and sent
+    together, ANAF_BATCH_SIZE CUIs per SOAP request, at most one request every
+    ANAF_MIN_REQUEST_INTERVAL seconds. Results (found or not) are cached by CUI.
+    """
+    def __init__(self, batch_size: int = ANAF_BATCH_SIZE, window: float = ANAF_BATCH_WINDOW,
+                 min_interval: float = ANAF_MIN_REQUEST_INTERVAL):
+        self.batch_size = batch_size
+        self.window = window
+        self.min_interval = min_interval
+        self.requests = 0
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_request = 0.0
+
+    async def lookup(self, cui) -> Optional[Dict[str, Any]]:
+        """The ANAF record of a CUI, or None if ANAF does not know it."""
+        cui = normalize_cui(cui)
+        if not cui:
+            return None
+        # The registry and caches are SQLite files; read them on the blocking I/O pool.
+        known, record = await run_blocking(cached_record, cui)
+        if known:
+            return record
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(cui, []).append(future)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def lookup_many(self, cuis: List) -> List[Optional[Dict[str, Any]]]:
+        """The records of many CUIs, in order, sent in as few requests as the limits allow."""
+        return await asyncio.gather(*(self.lookup(cui) for cui in cuis))
+
+    async def _flush(self):
+        """Sends the pending lookups in batches until none are left."""
+        while self._pending:
+            await asyncio.sleep(self.window)
+            batch_cuis = list(self._pending)[:self.batch_size]
+            waiters = {cui: self._pending.pop(cui) for cui in batch_cuis}
+
+            try:
+                records = await self._request(batch_cuis)
+            except Exception as e:
+                for cui, futures in waiters.items():
+                    stale = await run_blocking(stale_record, cui, e)
+                    for future in futures:
+                        if not future.done():
+                            if stale is not None:
+                                future.set_result(stale)
+                            else:
+                                future.set_exception(e)
+                continue
+            for cui, futures in waiters.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(records.get(cui))
+
+    async def _request(self, cuis: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        wait = self._last_request + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_request = time.monotonic()
+        self.requests += 1
+
+        client = get_clients().anaf
+        logger.info(f"Looking up {len(cuis)} CUI(s) in one ANAF request")
+        response = await call_upstream("anaf", lambda: run_blocking(client.service.wsPlatitorTva, _request_payload(cuis)))
+        return await run_blocking(_store_response, cuis, response)
+
+    async def verify(self, cui, expected_name: str, name_match_threshold: float = 0.6) -> Optional[Dict[str, Any]]:
+        """Like `get_company_details`: the record if the CUI exists and its name matches, otherwise None."""
+        try:
+            record = await self.lookup(cui)
+        except Fault as e:
+            logger.error(f"SOAP Fault for CUI {cui}: {e.message}")
+            return None
+        except CircuitOpenError as e:
+            logger.warning(f"Skipping the ANAF check of CUI {cui}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"An unexpected error occurred for CUI {cui}: {e}")
+            return None
+        if record is None:
+            logger.warning(f"CUI {cui} not found in ANAF database.")
+            return None
+        if not names_match(record["name"], expected_name, name_match_threshold):
+            return None
+        return record
+
+    async def verify_many(self, companies: List[Tuple[Any, str]], name_match_threshold: float = 0.6) -> List[Optional[Dict[str, Any]]]:
+        """Verifies (cui, expected_name) pairs concurrently; their lookups share requests."""
+        return await asyncio.gather(*(self.verify(cui, name, name_match_threshold) for cui, name in companies))
+
+_service: Optional[AnafVerificationService] = None
+
+def get_anaf_service() -> AnafVerificationService:
+    """Returns the process-wide verification service."""
+    global _service
+    if _service is None:
+        _service = AnafVerificationService()
+    return _service
 
 def get_company_details(cui: str, expected_name: str, name_match_threshold: float = 0.6) -> Optional[Dict[str, Any]]:
     """
-    Fetches and verifies company details from the ANAF v9 web service.
+    Fetches and verifies company details, from the local registry (see `anaf_registry.py`)
+    or the ANAF v9 web service for the CUIs it lacks or holds stale rows for.
 
     This function retrieves company data using its CUI, then compares the
     official name from ANAF with an expected name to ensure they are similar.
+    Blocking; async code should use `get_anaf_service().verify`, which batches lookups.
 
     Args:
         cui: The company's CUI (Cod Unic de Înregistrare).
@@ -31,48 +243,35 @@ def get_company_details(cui: str, expected_name: str, name_match_threshold: floa
         name is a reasonable match, otherwise None.
     """
     try:
-        client = Client(wsdl=WSDL_URL)
-        current_date = datetime.date.today().strftime("%Y-%m-%d")
-        payload = [{"cui": cui, "data": current_date}]
+        normalized = normalize_cui(cui)
+        known, record = cached_record(normalized)
+        if not known:
+            try:
+                # Shared client: the WSDL is parsed once and the HTTPS connection is kept alive.
+                client = get_clients().anaf
+                response = call_upstream_blocking("anaf", client.service.wsPlatitorTva, _request_payload([normalized]))
+                record = _store_response([normalized], response)[normalized]
+            except Exception as e:
+                record = stale_record(normalized, e)
+                if record is None:
+                    raise
 
-        response = client.service.wsPlatitorTva(payload)
-
-        if not response or not response.found:
+        if record is None:
             logger.warning(f"CUI {cui} not found in ANAF database.")
             return None
 
-        company_data = response.found[0]
-        anaf_name = company_data.date_generale.denumire
-
-        # Compare the name from ANAF with the expected name
-        similarity = SequenceMatcher(None, anaf_name.lower(), expected_name.lower()).ratio()
-
-        if similarity < name_match_threshold:
-            logger.warning(
-                f"Name mismatch for CUI {cui}. "
-                f"ANAF: '{anaf_name}', Expected: '{expected_name}', "
-                f"Similarity: {similarity:.2f}"
-            )
+        if not names_match(record["name"], expected_name, name_match_threshold):
             return None
 
-        logger.info(f"Successfully verified CUI {cui} for company '{anaf_name}'.")
-        return {
-            "cui": company_data.date_generale.cui,
-            "name": anaf_name,
-            "address": company_data.date_generale.adresa,
-            "phone": company_data.date_generale.telefon,
-            "vat_registered": company_data.date_generale.scpTVA,
-            "status": {
-                "vat_active_from": company_data.inregistrare_scop_Tva.d_inceput_ScpTVA,
-                "vat_inactive": company_data.stare_inregistrare_scop_TVA.stare_inactivare,
-                "reactivation_date": company_data.stare_inregistrare_scop_TVA.d_reactivare_TVA,
-                "cancellation_date": company_data.stare_inregistrare_scop_TVA.d_anulare_TVA,
-            }
-        }
+        logger.info(f"Successfully verified CUI {cui} for company '{record['name']}'.")
+        return record
 
     except Fault as e:
         logger.error(f"SOAP Fault for CUI {cui}: {e.message}")
         return None
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping the ANAF check of CUI {cui}: {e}")
+        return None
     except Exception as e:
         logger.error(f"An unexpected error occurred for CUI {cui}: {e}")
         return None
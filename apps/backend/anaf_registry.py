@@ -0,0 +1,257 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .shopping_agent.company_names import NameIndex, normalize_company_name
+
+logger = logging.getLogger(__name__)
+
+# --- ANAF Registry Configuration ---
+# Local copy of the company registry, loaded from bulk dumps with:
+#   python -m backend.anaf_registry ingest firme.csv [more files...]   (from the `apps` directory)
+ANAF_REGISTRY_PATH = os.getenv("ANAF_REGISTRY_PATH", "./anaf_registry.db")
+# Rows older than this are checked again against the live ANAF service.
+ANAF_REGISTRY_MAX_AGE = float(os.getenv("ANAF_REGISTRY_MAX_AGE", str(30 * 24 * 3600)))  # 30 days
+# Rows written per transaction while ingesting a dump.
+ANAF_REGISTRY_INGEST_BATCH = int(os.getenv("ANAF_REGISTRY_INGEST_BATCH", "5000"))
+# Name searches score at most this many candidates, those sharing the most words with the query.
+ANAF_REGISTRY_SEARCH_CANDIDATES = int(os.getenv("ANAF_REGISTRY_SEARCH_CANDIDATES", "2000"))
+
+# Column names used by the registry dumps (data.gov.ro, ANAF exports) for each field, lowercased.
+FIELD_ALIASES = {
+    "cui": ("cui", "cod_fiscal", "cif", "cod fiscal"),
+    "name": ("name", "denumire", "nume"),
+    "address": ("address", "adresa", "adr_completa", "adresa_completa"),
+    "phone": ("phone", "telefon"),
+    "vat_registered": ("vat_registered", "scptva", "platitor_tva", "tva"),
+    "vat_active_from": ("vat_active_from", "d_inceput_scptva", "data_inceput_tva"),
+    "vat_inactive": ("vat_inactive", "stare_inactivare", "inactiv"),
+    "reactivation_date": ("reactivation_date", "d_reactivare_tva"),
+    "cancellation_date": ("cancellation_date", "d_anulare_tva"),
+}
+TRUE_VALUES = {"1", "true", "da", "yes", "y"}
+
+def normalize_cui(cui) -> str:
+    """The digits of a CUI, without the "RO" VAT prefix or spaces."""
+    return "".join(ch for ch in str(cui) if ch.isdigit())
+
+def _flag(value) -> Optional[bool]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+class CompanyRegistry:
+    """
+    A SQLite copy of the ANAF company registry: one row per CUI with the fields of
+    `anaf.get_company_details`, plus the normalized name and an index of its words
+    for name -> CUI searches.
+    """
+    def __init__(self, path: str = ANAF_REGISTRY_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS companies (
+                    cui TEXT PRIMARY KEY,
+                    name TEXT,
+                    normalized_name TEXT,
+                    address TEXT,
+                    phone TEXT,
+                    vat_registered INTEGER,
+                    vat_active_from TEXT,
+                    vat_inactive INTEGER,
+                    reactivation_date TEXT,
+                    cancellation_date TEXT,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS companies_normalized_name ON companies (normalized_name);
+                CREATE TABLE IF NOT EXISTS company_words (
+                    word TEXT NOT NULL,
+                    cui TEXT NOT NULL,
+                    PRIMARY KEY (word, cui)
+                ) WITHOUT ROWID;
+            """)
+            self._conn.commit()
+
+    # --- Writes ---
+    def upsert(self, records: List[Dict[str, Any]], updated_at: Optional[float] = None) -> int:
+        """
+        Adds or refreshes records shaped like `anaf.get_company_details` results (the `status`
+        fields may also be given at the top level). Returns how many were stored.
+        """
+        updated_at = time.time() if updated_at is None else updated_at
+        rows, words = [], []
+        for record in records:
+            cui = normalize_cui(record.get("cui") or "")
+            if not cui:
+                continue
+            status = record.get("status") or record
+            normalized = normalize_company_name(record.get("name") or "")
+            rows.append((
+                cui, _text(record.get("name")), normalized, _text(record.get("address")), _text(record.get("phone")),
+                _flag(record.get("vat_registered")), _text(status.get("vat_active_from")), _flag(status.get("vat_inactive")),
+                _text(status.get("reactivation_date")), _text(status.get("cancellation_date")), updated_at,
+            ))
+            words.extend((word, cui) for word in set(normalized.split()))
+
+        with self._lock:
+            self._conn.executemany("DELETE FROM company_words WHERE cui = ?", [(row[0],) for row in rows])
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO companies (cui, name, normalized_name, address, phone, vat_registered,
+                    vat_active_from, vat_inactive, reactivation_date, cancellation_date, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            self._conn.executemany("INSERT OR IGNORE INTO company_words (word, cui) VALUES (?, ?)", words)
+            self._conn.commit()
+        return len(rows)
+
+    def ingest(self, path: str) -> int:
+        """Loads a registry dump (CSV, JSON array or JSON lines). Returns how many rows were stored."""
+        stored = 0
+        batch: List[Dict[str, Any]] = []
+        started = time.monotonic()
+        for record in read_dump(path):
+            batch.append(record)
+            if len(batch) >= ANAF_REGISTRY_INGEST_BATCH:
+                stored += self.upsert(batch)
+                batch = []
+        stored += self.upsert(batch)
+        logger.info(f"Ingested {stored} companies from {path} in {time.monotonic() - started:.1f}s")
+        return stored
+
+    # --- Reads ---
+    def get(self, cui, max_age: Optional[float] = ANAF_REGISTRY_MAX_AGE) -> Optional[Dict[str, Any]]:
+        """The record of a CUI, or None if it is unknown or older than `max_age` seconds (None: any age)."""
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT cui, name, address, phone, vat_registered, vat_active_from, vat_inactive,
+                    reactivation_date, cancellation_date, updated_at
+                FROM companies WHERE cui = ?
+                """,
+                (normalize_cui(cui),)
+            ).fetchone()
+        if row is None or (max_age is not None and time.time() - row[-1] > max_age):
+            return None
+        return _record(row)
+
+    def search(self, name: str, limit: int = 5, threshold: float = 0.5) -> List[Dict[str, Any]]:
+        """
+        Companies whose name resembles `name`, best first, each with its `similarity`.
+        Candidates share at least one word with `name` and are ranked by `company_names` similarity.
+        """
+        words = sorted(set(normalize_company_name(name).split()))
+        if not words:
+            return []
+        placeholders = ",".join("?" * len(words))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT cui, name, address, phone, vat_registered, vat_active_from, vat_inactive,
+                    reactivation_date, cancellation_date, updated_at
+                FROM companies JOIN (
+                    SELECT cui AS candidate FROM company_words WHERE word IN ({placeholders})
+                    GROUP BY cui ORDER BY COUNT(*) DESC LIMIT ?
+                ) ON cui = candidate
+                """,
+                (*words, ANAF_REGISTRY_SEARCH_CANDIDATES)
+            ).fetchall()
+        if not rows:
+            return []
+        index = NameIndex([row[1] or "" for row in rows])
+        return [{**_record(rows[i]), "similarity": round(score, 3)} for i, score in index.top(name, limit, threshold)]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+
+def _record(row: Tuple) -> Dict[str, Any]:
+    """A registry row in the shape returned by `anaf.get_company_details`."""
+    cui, name, address, phone, vat_registered, vat_active_from, vat_inactive, reactivation_date, cancellation_date, _ = row
+    return {
+        "cui": int(cui),
+        "name": name,
+        "address": address,
+        "phone": phone,
+        "vat_registered": None if vat_registered is None else bool(vat_registered),
+        "status": {
+            "vat_active_from": vat_active_from,
+            "vat_inactive": None if vat_inactive is None else bool(vat_inactive),
+            "reactivation_date": reactivation_date,
+            "cancellation_date": cancellation_date,
+        }
+    }
+
+def read_dump(path: str) -> Iterator[Dict[str, Any]]:
+    """The records of a dump file, with the dump's column names mapped to the registry fields."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith((".json", ".jsonl", ".ndjson")):
+            first = f.read(1)
+            f.seek(0)
+            rows = json.load(f) if first == "[" else (json.loads(line) for line in f if line.strip())
+        else:
+            # data.gov.ro dumps use "^" as separator; other exports use commas, semicolons or tabs.
+            dialect = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=",;^|\t")
+            f.seek(0)
+            rows = csv.DictReader(f, dialect=dialect)
+        for row in rows:
+            yield _map_fields(row)
+
+def _map_fields(row: Dict[str, Any]) -> Dict[str, Any]:
+    lowered = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+    record = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if lowered.get(alias) not in (None, ""):
+                record[field] = lowered[alias]
+                break
+    return record
+
+_registry: Optional[CompanyRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_company_registry() -> CompanyRegistry:
+    """Returns the process-wide registry, opening it on first use (from any thread)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CompanyRegistry()
+        return _registry
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Local copy of the ANAF company registry.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="Load registry dumps (CSV or JSON).")
+    ingest_parser.add_argument("paths", nargs="+")
+    search_parser = commands.add_parser("search", help="Find CUIs by company name.")
+    search_parser.add_argument("name")
+    search_parser.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+
+    registry = get_company_registry()
+    if args.command == "ingest":
+        for dump_path in args.paths:
+            registry.ingest(dump_path)
+        print(f"{len(registry)} companies in {ANAF_REGISTRY_PATH}")
+    else:
+        for match in registry.search(args.name, args.limit):
+            print(f"{match['similarity']:.2f}  {match['cui']}  {match['name']}  ({match['address'] or '-'})")
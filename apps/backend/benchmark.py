@@ -0,0 +1,303 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# Offline benchmark of the shopping agent.
+# Google Places, Tavily and OpenAI are replaced by fakes that replay the recorded responses in
+# `benchmark_fixtures/` with an injected, log-normally distributed latency, so the effect of
+# concurrency, caching and batching changes can be measured on a machine without network.
+# Run it from the `apps` directory:
+#   python -m backend.benchmark                                 -> drive shopping_graph directly
+#   python -m backend.benchmark --target app                    -> drive the FastAPI app (/shopping-assistant)
+#   python -m backend.benchmark --concurrency 1 10 50 --requests 100 --latency tavily=1.2 openai=2
+# Every run starts from empty in-memory caches in a temporary directory, which warm up from one
+# level to the next; --cold disables them to measure the upstream-bound path only.
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures", "bucharest_center.json")
+# Median latency (in seconds) of each fake upstream; the p95 is about 2.3 times higher.
+DEFAULT_LATENCIES = {"gmaps": 0.3, "tavily": 0.8, "openai": 1.2}
+LATENCY_SIGMA = 0.5
+CHARS_PER_TOKEN = 4
+
+def load_fixtures(path: str = FIXTURES_PATH) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+class InjectedLatency:
+    """Seeded log-normal delays around the median latency of every upstream."""
+    def __init__(self, medians: Dict[str, float], seed: int = 42):
+        self.medians = medians
+        self._random = random.Random(seed)
+
+    def delay(self, upstream: str) -> float:
+        median = self.medians.get(upstream, 0.0)
+        return median * self._random.lognormvariate(0, LATENCY_SIGMA) if median > 0 else 0.0
+
+# --- Fake Clients ---
+class FakeGmaps:
+    """Replays the recorded Places responses. Blocking, like googlemaps.Client."""
+    def __init__(self, fixtures: Dict[str, Any], latency: InjectedLatency):
+        self.fixtures = fixtures
+        self.latency = latency
+
+    def places_nearby(self, location=None, keyword=None, radius=None, language=None, type=None) -> Dict[str, Any]:
+        time.sleep(self.latency.delay("gmaps"))
+        return {"results": self.fixtures["places_nearby"], "status": "OK"}
+
+    def place(self, place_id: str, fields=None, language=None) -> Dict[str, Any]:
+        time.sleep(self.latency.delay("gmaps"))
+        return {"result": self.fixtures["place_details"].get(place_id, {}), "status": "OK"}
+
+class FakeTavily:
+    """Replays the recorded Tavily results: site searches rank the site's pages by word overlap."""
+    def __init__(self, fixtures: Dict[str, Any], latency: InjectedLatency):
+        self.fixtures = fixtures
+        self.latency = latency
+
+    async def search(self, query: str, max_results: int = 5, search_depth: str = "basic", **kwargs) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency.delay("tavily"))
+        site = re.search(r"site:(?:https?://)?([^\s/]+)", query)
+        if not site:
+            count = self.fixtures["tavily_popularity"].get(query.strip('"'), 0)
+            return {"results": [{"url": f"https://example.ro/{i}", "content": query} for i in range(min(count, max_results))]}
+
+        words = set(query[:site.start()].lower().split())
+        pages = self.fixtures["tavily_sites"].get(site.group(1), [])
+        ranked = sorted(pages, key=lambda p: -len(words & set(p["content"].lower().split())))
+        return {"results": [{"url": p["url"], "content": p["content"]} for p in ranked[:max_results]]}
+
+class FakeOpenAI:
+    """
+    Answers the Chat Completions API through an httpx transport, so the real LangChain models,
+    structured outputs and streaming run unchanged. Verdicts come from the `available` flag
+    of the recorded pages and query analyses from the recorded queries.
+    """
+    def __init__(self, fixtures: Dict[str, Any], latency: InjectedLatency):
+        self.latency = latency
+        self.analyses = {q["user_query"]: q["analysis"] for q in fixtures["queries"]}
+        pages = [p for site in fixtures["tavily_sites"].values() for p in site]
+        self.available_urls = {p["url"] for p in pages if p["available"]}
+        self.available_texts = {" ".join(p["content"].split()) for p in pages if p["available"]}
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency.delay("openai"))
+        body = json.loads(request.content)
+        prompt = "\n".join(str(m.get("content", "")) for m in body["messages"])
+        schema = self._schema_name(body)
+        content = json.dumps(self._structured(schema, prompt), ensure_ascii=False) if schema else self._text(prompt)
+        usage = {"prompt_tokens": len(prompt) // CHARS_PER_TOKEN, "completion_tokens": len(content) // CHARS_PER_TOKEN}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        tool_call = None
+        if schema and body.get("tools"):
+            tool_call = {"id": "call_benchmark", "type": "function", "function": {"name": schema, "arguments": content}}
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=self._stream(content, tool_call, usage))
+
+        message = {"role": "assistant", "content": None if tool_call else content}
+        if tool_call:
+            message["tool_calls"] = [tool_call]
+        return httpx.Response(200, json={
+            "id": "chatcmpl-benchmark", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop", "logprobs": None}],
+            "usage": usage,
+        })
+
+    @staticmethod
+    def _schema_name(body: Dict[str, Any]) -> Optional[str]:
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            return response_format["json_schema"]["name"]
+        for tool in body.get("tools") or []:
+            return tool["function"]["name"]
+        return None
+
+    def _structured(self, schema: str, prompt: str) -> Dict[str, Any]:
+        if schema == "VerificationBatch":
+            excerpts = re.findall(r"\[(\d+)\] URL: (\S+)", prompt)
+            return {"verdicts": [
+                {"id": int(i), "available": url in self.available_urls, "confidence": 0.9} for i, url in excerpts
+            ]}
+        queries = re.findall(r'User query: "(.*)"', prompt)
+        user_query = queries[-1] if queries else ""
+        return self.analyses.get(user_query) or {
+            "is_clothing_query": True, "main_product": user_query.split(" ")[0], "attributes": [], "search_keywords": user_query
+        }
+
+    def _text(self, prompt: str) -> str:
+        if 'Answer with only "yes" or "no"' in prompt:
+            text = re.search(r'Text: "(.*)"', prompt, re.S)
+            return "yes" if text and " ".join(text.group(1).split()) in self.available_texts else "no"
+        recommendations = [line for line in prompt.splitlines() if line.startswith("- Nume:")]
+        if not recommendations:
+            return "Îmi pare rău, nu am găsit magazine locale potrivite."
+        return "\n".join(["Iată câteva magazine locale unde găsești produsul:"] + recommendations)
+
+    @staticmethod
+    def _stream(content: str, tool_call: Optional[dict], usage: Dict[str, int]) -> bytes:
+        def chunk(delta: dict, finish_reason: Optional[str] = None, **extra) -> str:
+            choices = [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}] if delta is not None else []
+            data = {"id": "chatcmpl-benchmark", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": "gpt-4o", "choices": choices, **extra}
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        events = [chunk({"role": "assistant", "content": ""})]
+        if tool_call:
+            events.append(chunk({"tool_calls": [{"index": 0, **tool_call}]}))
+        else:
+            # A few words per chunk, like a real streamed answer.
+            words = content.split(" ")
+            for i in range(0, len(words), 4):
+                events.append(chunk({"content": " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")}))
+        events.append(chunk({}, "tool_calls" if tool_call else "stop"))
+        events.append(chunk(None, usage=usage))
+        events.append("data: [DONE]\n\n")
+        return "".join(events).encode("utf-8")
+
+# --- Harness ---
+class TraceCollector(logging.Handler):
+    """Collects the per-request traces logged by `metrics.py` (REQUEST_TRACE_LOGS)."""
+    def __init__(self):
+        super().__init__()
+        self.traces: List[Dict[str, Any]] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if message.startswith("request_trace "):
+            self.traces.append(json.loads(message[len("request_trace "):]))
+
+def install_fakes(fixtures: Dict[str, Any], latency: InjectedLatency):
+    """Puts the fakes in the shared client registry, before the graph builds its models."""
+    from .clients import get_clients
+    registry = get_clients()
+    registry._gmaps = FakeGmaps(fixtures, latency)
+    registry._tavily = FakeTavily(fixtures, latency)
+    registry.openai_http = httpx.AsyncClient(transport=FakeOpenAI(fixtures, latency).transport())
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+
+def summarize(label: str, values: List[float]) -> str:
+    return (f"  {label:<28} n={len(values):<5} p50={statistics.median(values):6.2f}s "
+            f"p95={percentile(values, 0.95):6.2f}s p99={percentile(values, 0.99):6.2f}s")
+
+async def run_level(send, queries: List[Dict[str, Any]], concurrency: int, total: int, collector: TraceCollector):
+    """Sends `total` requests with `concurrency` clients and prints throughput and latency percentiles."""
+    collector.traces.clear()
+    latencies: List[float] = []
+    errors: List[str] = []
+    counter = iter(range(total))
+
+    async def client():
+        for i in counter:
+            query = queries[i % len(queries)]
+            started = time.perf_counter()
+            try:
+                await send(query)
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    print(f"--- Concurrency {concurrency:>3}: {len(latencies)} completed, {len(errors)} errors in {elapsed:.1f}s "
+          f"({len(latencies) / elapsed:.2f} req/s) ---")
+    if latencies:
+        print(summarize("request", latencies))
+    spans = defaultdict(list)
+    for trace in collector.traces:
+        for span in trace["spans"]:
+            if span["kind"] in ("node", "upstream"):
+                spans[f"{span['kind']} {span['name']}"].append(span["seconds"])
+    for name in sorted(spans):
+        print(summarize(name, spans[name]))
+    for error in sorted(set(errors))[:5]:
+        print(f"  error: {error}")
+    print()
+
+async def main(args):
+    fixtures = load_fixtures(args.fixtures)
+    latency = InjectedLatency({**DEFAULT_LATENCIES, **args.latency}, seed=args.seed)
+    install_fakes(fixtures, latency)
+
+    from .shopping_agent import metrics, cache
+    collector = TraceCollector()
+    metrics.logger.addHandler(collector)
+    metrics.logger.setLevel(logging.INFO)
+    metrics.logger.propagate = False
+
+    if args.target == "app":
+        from .main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None)
+
+        async def send(query):
+            response = await client.post("/shopping-assistant", json={
+                "user_query": query["user_query"], "latitude": query["lat"], "longitude": query["lng"]
+            })
+            response.raise_for_status()
+    else:
+        from .shopping_agent.graph import shopping_graph
+        from .shopping_agent.budget import request_deadline
+
+        async def send(query):
+            with metrics.track_request("benchmark"):
+                await shopping_graph.ainvoke({
+                    "user_query": query["user_query"],
+                    "user_location": {"lat": query["lat"], "lng": query["lng"]},
+                    "messages": [("user", query["user_query"])],
+                    "deadline": request_deadline("web"),
+                })
+
+    print(f"--- Benchmarking {args.target} with {len(fixtures['queries'])} recorded queries, "
+          f"latencies {latency.medians} (median, seconds) ---\n")
+    for level in args.concurrency:
+        await run_level(send, fixtures["queries"], level, args.requests, collector)
+    print(f"--- Cache stats: {json.dumps(cache.cache_stats())} ---")
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the shopping agent with recorded upstream responses.")
+    parser.add_argument("--target", choices=["graph", "app"], default="graph")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--requests", type=int, default=20, help="Requests per concurrency level.")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="UPSTREAM=SECONDS",
+                        help="Median latency per upstream (gmaps, tavily, openai).")
+    parser.add_argument("--cold", action="store_true", help="Disable the place, nearby-search and response caches.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    args = parser.parse_args(argv)
+    args.latency = {k: float(v) for k, v in (item.split("=", 1) for item in args.latency)}
+    args.fixtures = os.path.abspath(args.fixtures)
+    return args
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    # Offline and isolated: every database and cache file goes to a temporary directory.
+    os.chdir(tempfile.mkdtemp(prefix="localcommerce-benchmark-"))
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("CACHE_BACKEND", "memory")
+    os.environ.setdefault("LOCAL_CATALOG_ENABLED", "false")
+    os.environ["REQUEST_TRACE_LOGS"] = "true"
+    if args.cold:
+        for ttl in ("PLACE_WEBSITE_TTL", "PLACE_SCORE_TTL", "NEARBY_SEARCH_TTL"):
+            os.environ[ttl] = "0"
+        os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
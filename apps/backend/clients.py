@@ -0,0 +1,178 @@
+import os
+import logging
+import threading
+from typing import Optional
+
+import httpx
+import requests
+import googlemaps
+from requests.adapters import HTTPAdapter
+from tavily import AsyncTavilyClient
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client as TwilioClient
+from zeep import Client as ZeepClient
+from zeep.cache import InMemoryCache
+from zeep.transports import Transport
+
+logger = logging.getLogger(__name__)
+
+# --- Client Pool Configuration ---
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "50"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# Default timeout (in seconds) for a single upstream HTTP call.
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+# How long the parsed ANAF WSDL (and the XSDs it imports) is kept, in seconds.
+ANAF_WSDL_CACHE_TTL = int(os.getenv("ANAF_WSDL_CACHE_TTL", str(24 * 3600)))
+ANAF_WSDL_URL = "https://webservicesp.anaf.ro/PlatitorTvaRest/api/v9/ws?wsdl"
+TAVILY_API_URL = "https://api.tavily.com"
+
+def _pooled_session() -> requests.Session:
+    """A requests session with a keep-alive pool sized like the async clients."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_MAX_KEEPALIVE, pool_maxsize=HTTP_POOL_MAX_CONNECTIONS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _async_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+class _SharedAsyncClient:
+    """
+    Hands out a long-lived httpx client to code that opens a new one per call
+    with `async with` (AsyncTavilyClient), without closing it afterwards.
+    """
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        return self.client
+
+    async def __aexit__(self, *exc_info) -> bool:
+        return False
+
+class ClientRegistry:
+    """
+    The upstream clients shared by every request for the lifetime of the app.
+    Each client is built on first use, so a missing API key only fails the
+    features that need it.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._gmaps: Optional[googlemaps.Client] = None
+        self._tavily: Optional[AsyncTavilyClient] = None
+        self._tavily_http: Optional[httpx.AsyncClient] = None
+        self._twilio: Optional[TwilioClient] = None
+        self._anaf: Optional[ZeepClient] = None
+        # Passed to the module-level ChatOpenAI models, so it lives as long as the process.
+        self.openai_http = httpx.AsyncClient(limits=_async_limits(), timeout=HTTP_TIMEOUT)
+
+    @property
+    def gmaps(self) -> googlemaps.Client:
+        with self._lock:
+            if self._gmaps is None:
+                api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+                if not api_key:
+                    raise ValueError("GOOGLE_MAPS_API_KEY environment variable not set.")
+                # The client's own retries (up to a minute) are disabled: `resilience.py` retries within a budget.
+                self._gmaps = googlemaps.Client(
+                    key=api_key, timeout=HTTP_TIMEOUT, retry_timeout=0, retry_over_query_limit=False,
+                    requests_session=_pooled_session()
+                )
+            return self._gmaps
+
+    @property
+    def tavily(self) -> AsyncTavilyClient:
+        with self._lock:
+            if self._tavily is None:
+                api_key = os.getenv("TAVILY_API_KEY")
+                if not api_key:
+                    raise ValueError("TAVILY_API_KEY environment variable not set.")
+                self._tavily_http = httpx.AsyncClient(
+                    base_url=TAVILY_API_URL,
+                    headers={
+                        "Content-Type": "application/json",
+                        "Authorization": f"Bearer {api_key}",
+                        "X-Client-Source": "tavily-python",
+                    },
+                    limits=_async_limits(),
+                    timeout=HTTP_TIMEOUT,
+                )
+                tavily = AsyncTavilyClient(api_key=api_key)
+                # AsyncTavilyClient has no public option for passing an httpx client; it opens a new one
+                # per call through the private `_client_creator`. Replacing it relies on the internals of
+                # the version pinned in requirements.txt (tavily-python==0.7.14): check it when upgrading.
+                if hasattr(tavily, "_client_creator"):
+                    shared = _SharedAsyncClient(self._tavily_http)
+                    tavily._client_creator = lambda: shared
+                else:
+                    logger.warning("AsyncTavilyClient has no _client_creator; Tavily calls will not share a connection pool.")
+                self._tavily = tavily
+            return self._tavily
+
+    @property
+    def twilio(self) -> TwilioClient:
+        with self._lock:
+            if self._twilio is None:
+                account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+                auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+                if not account_sid or not auth_token:
+                    raise ValueError("TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN environment variables not set.")
+                http_client = TwilioHttpClient(pool_connections=True, timeout=HTTP_TIMEOUT)
+                self._twilio = TwilioClient(account_sid, auth_token, http_client=http_client)
+            return self._twilio
+
+    @property
+    def anaf(self) -> ZeepClient:
+        """The ANAF SOAP client; its WSDL is downloaded and parsed only once."""
+        with self._lock:
+            if self._anaf is None:
+                transport = Transport(
+                    session=_pooled_session(),
+                    cache=InMemoryCache(timeout=ANAF_WSDL_CACHE_TTL),
+                    timeout=HTTP_TIMEOUT,
+                    operation_timeout=HTTP_TIMEOUT,
+                )
+                self._anaf = ZeepClient(wsdl=ANAF_WSDL_URL, transport=transport)
+            return self._anaf
+
+    async def aclose(self):
+        """Closes the connection pools, except the OpenAI one held by the models."""
+        if self._tavily_http is not None:
+            await self._tavily_http.aclose()
+        if self._gmaps is not None:
+            self._gmaps.session.close()
+        if self._twilio is not None:
+            self._twilio.http_client.session.close()
+        if self._anaf is not None:
+            self._anaf.transport.session.close()
+
+    def reset(self):
+        """Forgets the closed clients so that they are built again on next use."""
+        with self._lock:
+            self._gmaps = self._tavily = self._tavily_http = self._twilio = self._anaf = None
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_clients() -> ClientRegistry:
+    """Returns the process-wide client registry, creating it on first use."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
+
+async def close_clients():
+    """Closes the registry's pools; clients are rebuilt on their next use."""
+    with _registry_lock:
+        registry = _registry
+    if registry is not None:
+        await registry.aclose()
+        registry.reset()
+        logger.info("Closed the shared upstream clients.")
@@ -1,7 +1,9 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import models, schemas
-from .security import get_password_hash, verify_password
+from .security import get_password_hash, verify_password, get_password_hash_async, verify_password_async
 
 def get_user_by_email(db: Session, email: str):
     """Găsește un utilizator după email."""
@@ -32,4 +34,46 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    return db_user
+
+# --- Async versions, used by the API routes ---
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    """Găsește un utilizator după email."""
+    result = await db.execute(select(models.User).where(models.User.email == email).limit(1))
+    return result.scalars().first()
+
+async def get_user_by_phone_number_async(db: AsyncSession, phone_number: str):
+    """Găsește un utilizator după numărul de telefon."""
+    result = await db.execute(select(models.User).where(models.User.phone_number == phone_number).limit(1))
+    return result.scalars().first()
+
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
+    """
+    Autentifică un utilizator.
+    """
+    user = await get_user_by_email_async(db, email=email)
+    if not user:
+        return False
+    # Ends the read transaction: its pooled connection is not held while the password is checked.
+    await db.commit()
+    if not await verify_password_async(password, user.hashed_password):
+        return False
+    return user
+
+async def create_user_async(db: AsyncSession, user: schemas.UserCreate):
+    """Creează un utilizator nou în baza de date."""
+    # Ends the transaction of the caller's checks: its pooled connection is not held while hashing.
+    await db.commit()
+    hashed_password = await get_password_hash_async(user.password)
+    db_user = models.User(
+        email=user.email,
+        hashed_password=hashed_password,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        phone_number=user.phone_number,
+        date_of_birth=user.date_of_birth
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
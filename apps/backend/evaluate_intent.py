@@ -0,0 +1,75 @@
+import sys
+import random
+
+from shopping_agent.intent import IntentClassifier, load_labeled_queries, extract_locally
+
+# Offline evaluation of the local intent classifier.
+# Usage (from apps/backend):
+#   python evaluate_intent.py                  -> 5-fold cross-validation on the bundled labeled queries
+#   python evaluate_intent.py my_queries.jsonl -> train on the bundled queries, evaluate on your own file
+
+FOLDS = 5
+
+def evaluate(classifier, labeled):
+    """Routes every query and returns (local decisions, queries sent to the LLM)."""
+    decided, deferred = [], []
+    for query, label in labeled:
+        decision, probability = classifier.classify(query)
+        if decision is None:
+            deferred.append((query, label, probability))
+        else:
+            decided.append((query, label, decision, probability))
+    return decided, deferred
+
+def report(decided, deferred):
+    total = len(decided) + len(deferred)
+    true_pos = sum(1 for _, label, decision, _ in decided if label and decision)
+    false_pos = sum(1 for _, label, decision, _ in decided if not label and decision)
+    false_neg = sum(1 for _, label, decision, _ in decided if label and not decision)
+    positives = sum(1 for _, label, _, _ in decided if label) + sum(1 for _, label, _ in deferred if label)
+    correct = sum(1 for _, label, decision, _ in decided if label == decision)
+
+    print(f"Queries evaluated:           {total}")
+    print(f"Decided locally:             {len(decided)} ({len(decided) / total:.1%} of LLM classification calls avoided)")
+    print(f"Sent to the LLM:             {len(deferred)}")
+    print(f"Local accuracy:              {correct / len(decided):.1%}" if decided else "Local accuracy:              n/a")
+    print(f"Local precision (clothing):  {true_pos / (true_pos + false_pos):.1%}" if true_pos + false_pos else "Local precision (clothing):  n/a")
+    print(f"Local recall (clothing):     {true_pos / positives:.1%} of all clothing queries" if positives else "Local recall (clothing):     n/a")
+    print(f"Clothing queries rejected:   {false_neg}")
+
+    mistakes = [(q, label, p) for q, label, decision, p in decided if label != decision]
+    if mistakes:
+        print("\n--- ❌ Local mistakes ---")
+        for query, label, probability in mistakes:
+            print(f"  expected={label!s:5} p={probability:.2f}  {query}")
+    if deferred:
+        print("\n--- 🤔 Ambiguous (sent to the LLM) ---")
+        for query, label, probability in deferred:
+            print(f"  expected={label!s:5} p={probability:.2f}  {query}")
+
+    extracted = [extract_locally(q) for q, _, decision, _ in decided if decision]
+    if extracted:
+        print("\n--- 🔎 Sample local extractions ---")
+        for extraction in extracted[:5]:
+            print(f"  {extraction}")
+
+if __name__ == "__main__":
+    labeled = load_labeled_queries()
+
+    if len(sys.argv) > 1:
+        classifier = IntentClassifier().fit([q for q, _ in labeled], [l for _, l in labeled])
+        print(f"--- Evaluating on '{sys.argv[1]}' ---\n")
+        report(*evaluate(classifier, load_labeled_queries(sys.argv[1])))
+    else:
+        print(f"--- {FOLDS}-fold cross-validation on {len(labeled)} bundled queries ---\n")
+        shuffled = labeled[:]
+        random.Random(42).shuffle(shuffled)
+        all_decided, all_deferred = [], []
+        for fold in range(FOLDS):
+            held_out = shuffled[fold::FOLDS]
+            training = [item for i, item in enumerate(shuffled) if i % FOLDS != fold]
+            classifier = IntentClassifier().fit([q for q, _ in training], [l for _, l in training])
+            decided, deferred = evaluate(classifier, held_out)
+            all_decided += decided
+            all_deferred += deferred
+        report(all_decided, all_deferred)
@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import random
+from difflib import SequenceMatcher
+
+from shopping_agent.company_names import NameIndex, name_similarity
+
+# Offline comparison of the company name matchers used for ANAF verification:
+# the previous difflib.SequenceMatcher on lowercased names and the normalized n-gram index.
+# Usage (from apps/backend):
+#   python evaluate_name_matching.py            -> names of the benchmark fixtures, 20 variants each
+#   python evaluate_name_matching.py names.txt  -> one company name per line
+
+THRESHOLD = 0.6
+VARIANTS_PER_NAME = 20
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures", "bucharest_center.json")
+LEGAL_FORMS = ["SRL", "S.R.L.", "s.r.l.", "S.R.L", "SRL-D", "S.A.", "SA"]
+DIACRITICS = str.maketrans("ăâîșşțţĂÂÎȘŞȚŢ", "aaissttAAISSTT")
+
+def load_names(path=None):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    with open(FIXTURES_PATH, encoding="utf-8") as f:
+        return [place["name"] for place in json.load(f)["places_nearby"]]
+
+def variant(name: str, rnd: random.Random) -> str:
+    """How the same company may be written elsewhere: legal form, case, diacritics, word order, a typo."""
+    words = name.split()
+    if len(words) > 1 and rnd.random() < 0.4:
+        words = words[1:] + words[:1]
+    text = " ".join(words)
+    if rnd.random() < 0.5:
+        text = text.translate(DIACRITICS)
+    if rnd.random() < 0.5:
+        text = text.upper()
+    if rnd.random() < 0.3 and len(text) > 4:
+        i = rnd.randrange(1, len(text) - 1)
+        text = text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    if rnd.random() < 0.8:
+        form = rnd.choice(LEGAL_FORMS)
+        text = f"S.C. {text} {form}" if rnd.random() < 0.3 else f"{text} {form}"
+    return text
+
+def sequence_matcher_best(candidates, query):
+    scores = [SequenceMatcher(None, c.lower(), query.lower()).ratio() for c in candidates]
+    best = max(range(len(scores)), key=scores.__getitem__)
+    return best, scores[best]
+
+def report(label, matches, expected, seconds):
+    correct = sum(1 for (index, _), truth in zip(matches, expected) if index == truth)
+    missed = sum(1 for index, _ in matches if index == -1)
+    print(f"--- {label} ---")
+    print(f"  accuracy at {THRESHOLD}: {correct / len(expected):.1%} ({missed} below the threshold)")
+    print(f"  time: {seconds * 1000:.1f} ms ({seconds / len(expected) * 1e6:.0f} µs per name)\n")
+
+if __name__ == "__main__":
+    candidates = load_names(sys.argv[1] if len(sys.argv) > 1 else None)
+    rnd = random.Random(42)
+    queries, expected = [], []
+    for index, name in enumerate(candidates):
+        for _ in range(VARIANTS_PER_NAME):
+            queries.append(variant(name, rnd))
+            expected.append(index)
+    print(f"--- Matching {len(queries)} name variants against {len(candidates)} companies ---\n")
+
+    started = time.perf_counter()
+    baseline = []
+    for query in queries:
+        index, score = sequence_matcher_best(candidates, query)
+        baseline.append((index if score >= THRESHOLD else -1, score))
+    report("difflib.SequenceMatcher (previous)", baseline, expected, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    index = NameIndex(candidates)
+    matches = index.match_all(queries, THRESHOLD)
+    report("NameIndex (normalized n-grams)", matches, expected, time.perf_counter() - started)
+
+    # The index and the pairwise similarity must agree.
+    sample = queries[:50]
+    drift = max(abs(index.scores(q)[i] - name_similarity(q, candidates[i])) for q in sample for i in range(len(candidates)))
+    print(f"--- Max difference between NameIndex and name_similarity: {drift:.2e} ---")
@@ -0,0 +1,428 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Protocol, Sequence
+
+from .shopping_agent.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# --- Job Queue Configuration ---
+# "sqlite" persists jobs and is shared by every process using the same file,
+# "memory" only works when the workers run inside the web process.
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "sqlite")
+JOB_QUEUE_DB_PATH = os.getenv("JOB_QUEUE_DB_PATH", "./jobs.db")
+# Jobs processed at the same time by one worker pool.
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+# How often (in seconds) an idle worker pool looks for new jobs.
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+# A claimed job is handed to another worker if it is not finished within this
+# many seconds (e.g. because its worker crashed). Keep it above the longest agent run.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Retries wait base * 2^(attempt - 1) seconds, capped and jittered.
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "2"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "300"))
+# Jobs sharing a group key (e.g. the messages of one sender) are held back while more keep
+# arriving, but never longer than this many seconds after the first one.
+JOB_GROUP_MAX_DELAY = float(os.getenv("JOB_GROUP_MAX_DELAY", "10"))
+# Finished jobs are kept this long (in seconds) so that redelivered webhooks are still deduplicated.
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+@dataclass
+class Job:
+    """A unit of work. Handlers may update `payload`; it is saved when the job is retried."""
+    id: int
+    queue: str
+    payload: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+    dedup_key: Optional[str] = None
+    group_key: Optional[str] = None
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot succeed."""
+
+# Recorded as the error of jobs whose lease expired on their last attempt.
+EXHAUSTED_ERROR = "Lease expired on the last attempt (the worker probably crashed)"
+
+def retry_delay(attempts: int) -> float:
+    """The jittered exponential backoff before the next attempt."""
+    delay = min(JOB_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), JOB_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+# --- Backends ---
+class JobQueue(Protocol):
+    """Storage of jobs shared by the producers (the webhook) and the worker pools."""
+    def enqueue(self, queue: str, payload: Dict[str, Any], dedup_key: Optional[str] = None,
+                max_attempts: int = JOB_MAX_ATTEMPTS, group_key: Optional[str] = None, delay: float = 0.0) -> Optional[int]:
+        """
+        Adds a job that becomes ready after `delay` seconds. Returns its id, or None if a job
+        with the same dedup key already exists. The queued jobs of the same group are delayed
+        along with it, up to JOB_GROUP_MAX_DELAY.
+        """
+        ...
+
+    def claim(self, queues: Sequence[str], limit: int, lease: float = JOB_LEASE_SECONDS) -> List[Job]:
+        """
+        Marks up to `limit` ready jobs as running for `lease` seconds and returns them.
+        Jobs of a group run one at a time, oldest first.
+        """
+        ...
+
+    def take_group(self, job: Job) -> int:
+        """
+        Moves the payloads of the other queued jobs of the job's group into `job.payload["merged"]`,
+        saves it, and marks those jobs as merged. Returns how many were taken.
+        """
+        ...
+
+    def complete(self, job: Job) -> None:
+        ...
+
+    def fail(self, job: Job, error: str, retry_in: Optional[float]) -> None:
+        """Schedules the job again in `retry_in` seconds, or gives up on it if that is None."""
+        ...
+
+    def purge(self, older_than: float = JOB_RETENTION_SECONDS) -> int:
+        """Deletes finished jobs older than the given age. Returns how many were deleted."""
+        ...
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of jobs per status."""
+        ...
+
+class InMemoryJobQueue:
+    """A queue that lives in the process, for development and embedded workers."""
+    def __init__(self):
+        self._jobs: Dict[int, Dict[str, Any]] = {}
+        self._dedup: Dict[tuple, int] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def enqueue(self, queue, payload, dedup_key=None, max_attempts=JOB_MAX_ATTEMPTS, group_key=None, delay=0.0):
+        with self._lock:
+            if dedup_key is not None and (queue, dedup_key) in self._dedup:
+                return None
+            job_id, self._next_id = self._next_id, self._next_id + 1
+            now = time.time()
+            self._jobs[job_id] = {
+                "id": job_id, "queue": queue, "payload": payload, "dedup_key": dedup_key, "group_key": group_key,
+                "status": "queued", "attempts": 0, "max_attempts": max_attempts, "run_at": now + delay,
+                "locked_until": None, "last_error": None, "created_at": now, "updated_at": now,
+            }
+            if dedup_key is not None:
+                self._dedup[(queue, dedup_key)] = job_id
+            if group_key is not None:
+                for job in self._group(queue, group_key):
+                    if job["status"] == "queued":
+                        job["run_at"] = max(job["run_at"], min(now + delay, job["created_at"] + JOB_GROUP_MAX_DELAY))
+            return job_id
+
+    def _group(self, queue, group_key):
+        return [j for j in self._jobs.values() if j["queue"] == queue and j["group_key"] == group_key]
+
+    def claim(self, queues, limit, lease=JOB_LEASE_SECONDS):
+        now = time.time()
+        with self._lock:
+            for job in self._jobs.values():
+                if job["attempts"] >= job["max_attempts"] and (
+                        job["status"] == "queued" or (job["status"] == "running" and job["locked_until"] <= now)):
+                    job.update(status="failed", last_error=EXHAUSTED_ERROR, locked_until=None, updated_at=now)
+                    logger.error(f"Job {job['id']} ({job['queue']}) failed for good: {EXHAUSTED_ERROR}")
+            ready, busy_groups = [], set()
+            for job in sorted(self._jobs.values(), key=lambda j: j["id"]):
+                group = (job["queue"], job["group_key"])
+                if job["group_key"] is not None and job["status"] in ("queued", "running"):
+                    if group in busy_groups:
+                        continue
+                    busy_groups.add(group)
+                if job["queue"] in queues and job["attempts"] < job["max_attempts"] and (
+                        (job["status"] == "queued" and job["run_at"] <= now)
+                        or (job["status"] == "running" and job["locked_until"] <= now)):
+                    ready.append(job)
+            ready = sorted(ready, key=lambda j: j["run_at"])[:limit]
+            for job in ready:
+                job.update(status="running", attempts=job["attempts"] + 1, locked_until=now + lease, updated_at=now)
+            return [Job(j["id"], j["queue"], dict(j["payload"]), j["attempts"], j["max_attempts"], j["dedup_key"],
+                        j["group_key"]) for j in ready]
+
+    def take_group(self, job):
+        if job.group_key is None:
+            return 0
+        with self._lock:
+            others = [j for j in self._group(job.queue, job.group_key) if j["status"] == "queued" and j["id"] != job.id]
+            for other in sorted(others, key=lambda j: j["id"]):
+                job.payload.setdefault("merged", []).append(other["payload"])
+                other.update(status="merged", updated_at=time.time())
+            self._jobs[job.id]["payload"] = job.payload
+            return len(others)
+
+    def complete(self, job):
+        with self._lock:
+            self._jobs[job.id].update(status="done", payload=job.payload, locked_until=None, updated_at=time.time())
+
+    def fail(self, job, error, retry_in):
+        now = time.time()
+        with self._lock:
+            record = self._jobs[job.id]
+            record.update(payload=job.payload, last_error=error, locked_until=None, updated_at=now)
+            if retry_in is None:
+                record["status"] = "failed"
+            else:
+                record.update(status="queued", run_at=now + retry_in)
+
+    def purge(self, older_than=JOB_RETENTION_SECONDS):
+        cutoff = time.time() - older_than
+        with self._lock:
+            expired = [j for j in self._jobs.values()
+                       if j["status"] in ("done", "failed", "merged") and j["updated_at"] < cutoff]
+            for job in expired:
+                self._jobs.pop(job["id"])
+                self._dedup.pop((job["queue"], job["dedup_key"]), None)
+            return len(expired)
+
+    def counts(self):
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+class SQLiteJobQueue:
+    """
+    A queue persisted in a SQLite file. Several worker processes can share it:
+    jobs are claimed with a single atomic UPDATE ... RETURNING statement.
+    """
+    def __init__(self, path: str = JOB_QUEUE_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    queue TEXT NOT NULL,
+                    dedup_key TEXT,
+                    group_key TEXT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    run_at REAL NOT NULL,
+                    locked_until REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    UNIQUE (queue, dedup_key)
+                )
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "group_key" not in columns:
+                # Queue files created before jobs could be grouped.
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN group_key TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_group ON jobs (queue, group_key, status)")
+            self._conn.commit()
+
+    def enqueue(self, queue, payload, dedup_key=None, max_attempts=JOB_MAX_ATTEMPTS, group_key=None, delay=0.0):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (queue, dedup_key, group_key, payload, status, max_attempts, run_at, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (queue, dedup_key, group_key, json.dumps(payload), max_attempts, now + delay, now, now)
+            )
+            if cursor.rowcount and group_key is not None:
+                self._conn.execute(
+                    "UPDATE jobs SET run_at = MAX(run_at, MIN(?, created_at + ?)) "
+                    "WHERE queue = ? AND group_key = ? AND status = 'queued'",
+                    (now + delay, JOB_GROUP_MAX_DELAY, queue, group_key)
+                )
+            self._conn.commit()
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, queues, limit, lease=JOB_LEASE_SECONDS):
+        now = time.time()
+        placeholders = ", ".join("?" for _ in queues)
+        with self._lock:
+            # Poison jobs, whose every attempt crashed its worker, fail instead of being handed out again.
+            exhausted = self._conn.execute(
+                "UPDATE jobs SET status = 'failed', last_error = ?, locked_until = NULL, updated_at = ? "
+                "WHERE attempts >= max_attempts "
+                "AND (status = 'queued' OR (status = 'running' AND locked_until <= ?)) RETURNING id",
+                (EXHAUSTED_ERROR, now, now)
+            ).fetchall()
+            if exhausted:
+                logger.error(f"Job(s) {[r[0] for r in exhausted]} failed for good: {EXHAUSTED_ERROR}")
+            rows = self._conn.execute(
+                f"""
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ?, updated_at = ?
+                WHERE id IN (
+                    SELECT id FROM jobs AS j
+                    WHERE queue IN ({placeholders}) AND attempts < max_attempts
+                      AND ((status = 'queued' AND run_at <= ?) OR (status = 'running' AND locked_until <= ?))
+                      -- One job per group at a time: skip groups with a live run or an older pending job.
+                      AND (group_key IS NULL OR NOT EXISTS (
+                          SELECT 1 FROM jobs AS o
+                          WHERE o.queue = j.queue AND o.group_key = j.group_key AND o.id != j.id
+                            AND ((o.status = 'running' AND o.locked_until > ?)
+                                 OR (o.status IN ('queued', 'running') AND o.id < j.id))
+                      ))
+                    ORDER BY run_at LIMIT ?
+                )
+                RETURNING id, queue, payload, attempts, max_attempts, dedup_key, group_key
+                """,
+                (now + lease, now, *queues, now, now, now, limit)
+            ).fetchall()
+            self._conn.commit()
+        return [Job(r[0], r[1], json.loads(r[2]), r[3], r[4], r[5], r[6]) for r in rows]
+
+    def take_group(self, job):
+        if job.group_key is None:
+            return 0
+        with self._lock:
+            rows = self._conn.execute(
+                "UPDATE jobs SET status = 'merged', updated_at = ? "
+                "WHERE queue = ? AND group_key = ? AND status = 'queued' AND id != ? RETURNING id, payload",
+                (time.time(), job.queue, job.group_key, job.id)
+            ).fetchall()
+            for _, payload in sorted(rows):
+                job.payload.setdefault("merged", []).append(json.loads(payload))
+            if rows:
+                # Saved in the same transaction, so a crash cannot lose the merged messages.
+                self._conn.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(job.payload), job.id))
+            self._conn.commit()
+        return len(rows)
+
+    def complete(self, job):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', payload = ?, locked_until = NULL, updated_at = ? WHERE id = ?",
+                (json.dumps(job.payload), time.time(), job.id)
+            )
+            self._conn.commit()
+
+    def fail(self, job, error, retry_in):
+        now = time.time()
+        with self._lock:
+            if retry_in is None:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', payload = ?, last_error = ?, locked_until = NULL, updated_at = ? "
+                    "WHERE id = ?",
+                    (json.dumps(job.payload), error, now, job.id)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', payload = ?, last_error = ?, locked_until = NULL, run_at = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (json.dumps(job.payload), error, now + retry_in, now, job.id)
+                )
+            self._conn.commit()
+
+    def purge(self, older_than=JOB_RETENTION_SECONDS):
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed', 'merged') AND updated_at < ?", (time.time() - older_than,)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+def create_job_queue() -> JobQueue:
+    """Creates the queue selected by JOB_QUEUE_BACKEND."""
+    if JOB_QUEUE_BACKEND == "memory":
+        return InMemoryJobQueue()
+    if JOB_QUEUE_BACKEND == "sqlite":
+        return SQLiteJobQueue(JOB_QUEUE_DB_PATH)
+    raise ValueError(f"Unknown JOB_QUEUE_BACKEND '{JOB_QUEUE_BACKEND}'. Use 'sqlite' or 'memory'.")
+
+_job_queue: Optional[JobQueue] = None
+
+def get_job_queue() -> JobQueue:
+    """Returns the process-wide job queue."""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = create_job_queue()
+    return _job_queue
+
+# --- Worker Pool ---
+JobHandler = Callable[[Job], Awaitable[None]]
+
+class WorkerPool:
+    """
+    Runs jobs from the queue with at most `concurrency` of them in flight.
+    A handler that raises is retried with backoff until the job runs out of attempts;
+    PermanentJobError gives up immediately.
+    """
+    def __init__(self, queue: JobQueue, handlers: Dict[str, JobHandler],
+                 concurrency: int = JOB_WORKER_CONCURRENCY, poll_interval: float = JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._running: set = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        """Stops claiming new jobs; `run()` returns once the running ones are finished."""
+        self._stopping.set()
+
+    async def _execute(self, job: Job) -> None:
+        handler = self.handlers[job.queue]
+        try:
+            await handler(job)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, PermanentJobError) or job.attempts >= job.max_attempts:
+                logger.error(f"Job {job.id} ({job.queue}) failed for good after {job.attempts} attempt(s): {error}")
+                await run_blocking(self.queue.fail, job, error, None)
+            else:
+                delay = retry_delay(job.attempts)
+                logger.warning(f"Job {job.id} ({job.queue}) attempt {job.attempts} failed, retrying in {delay:.1f}s: {error}")
+                await run_blocking(self.queue.fail, job, error, delay)
+            return
+        await run_blocking(self.queue.complete, job)
+
+    async def run(self) -> None:
+        """Claims and runs jobs until `stop()` is called."""
+        logger.info(f"Worker pool started for {sorted(self.handlers)} with concurrency {self.concurrency}")
+        last_purge = 0.0
+        while not self._stopping.is_set():
+            if time.time() - last_purge > 3600:
+                purged = await run_blocking(self.queue.purge)
+                if purged:
+                    logger.info(f"Purged {purged} finished job(s)")
+                last_purge = time.time()
+
+            free = self.concurrency - len(self._running)
+            jobs: List[Job] = []
+            if free > 0:
+                try:
+                    jobs = await run_blocking(self.queue.claim, list(self.handlers), free)
+                except Exception as e:
+                    logger.error(f"Could not claim jobs: {e}")
+            for job in jobs:
+                task = asyncio.create_task(self._execute(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            if not jobs or len(self._running) >= self.concurrency:
+                # Sleep until the next poll, a finished job frees a slot, or we are asked to stop.
+                waiters = [asyncio.ensure_future(self._stopping.wait()), *self._running]
+                await asyncio.wait(waiters, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                waiters[0].cancel()
+
+        if self._running:
+            logger.info(f"Waiting for {len(self._running)} running job(s) to finish")
+            await asyncio.gather(*self._running, return_exceptions=True)
@@ -0,0 +1,63 @@
+import sys
+import time
+import asyncio
+import statistics
+
+import httpx
+
+# Concurrent load test for a running backend (`uvicorn backend.main:app`).
+# It sends the same number of requests per client at growing concurrency levels:
+# if the agent layer never blocks the event loop, throughput grows with concurrency
+# instead of staying flat.
+# Usage: python load_test.py [base_url] [requests_per_client]
+
+API_URL = (sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:8000") + "/shopping-assistant"
+REQUESTS_PER_CLIENT = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+CONCURRENCY_LEVELS = [1, 5, 10, 20]
+
+# A few queries around Piața Unirii, București, so caches do not answer everything.
+QUERIES = [
+    ("Vreau să cumpăr o jachetă neagră de piele.", 44.4268, 26.1025),
+    ("Caut o rochie roșie de seară", 44.4355, 26.1000),
+    ("Unde găsesc blugi skinny albaștri?", 44.4200, 26.1150),
+    ("Am nevoie de un palton gri de lână", 44.4410, 26.0960),
+    ("Caut pantofi sport albi", 44.4300, 26.1300),
+]
+
+async def client_worker(client: httpx.AsyncClient, worker_id: int, latencies: list, errors: list):
+    for i in range(REQUESTS_PER_CLIENT):
+        user_query, latitude, longitude = QUERIES[(worker_id + i) % len(QUERIES)]
+        start = time.perf_counter()
+        try:
+            response = await client.post(API_URL, json={"user_query": user_query, "latitude": latitude, "longitude": longitude})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError as e:
+            errors.append(str(e))
+
+async def run_level(concurrency: int):
+    latencies, errors = [], []
+    async with httpx.AsyncClient(timeout=300) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_worker(client, w, latencies, errors) for w in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    completed = len(latencies)
+    print(f"--- Concurrency {concurrency:>3} ---")
+    print(f"  completed: {completed}, errors: {len(errors)}, wall time: {elapsed:.1f}s")
+    print(f"  throughput: {completed / elapsed:.2f} req/s")
+    if latencies:
+        ordered = sorted(latencies)
+        print(f"  latency p50: {statistics.median(ordered):.1f}s, p95: {ordered[int(0.95 * (completed - 1))]:.1f}s, max: {ordered[-1]:.1f}s")
+    return completed / elapsed
+
+if __name__ == "__main__":
+    print(f"--- Load testing {API_URL} with {REQUESTS_PER_CLIENT} request(s) per client ---\n")
+    throughputs = {}
+    for level in CONCURRENCY_LEVELS:
+        throughputs[level] = asyncio.run(run_level(level))
+
+    baseline = throughputs[CONCURRENCY_LEVELS[0]] or 1e-9
+    print("\n--- Scaling vs. a single client ---")
+    for level, throughput in throughputs.items():
+        print(f"  {level:>3} clients: {throughput / baseline:.1f}x")
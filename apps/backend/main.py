@@ -1,6 +1,9 @@
 from dotenv import load_dotenv
 import os
+import json
+import asyncio
 import logging
+from typing import Optional
 
 # --- Environment Variable Loading ---
 # Build a path to the .env file relative to this file's location (backend/.env)
@@ -14,33 +17,66 @@ load_dotenv(dotenv_path=dotenv_path)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Form
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from .shopping_agent.graph import shopping_graph
-from twilio.rest import Client as TwilioClient
-
+from .shopping_agent.concurrency import run_blocking
+from .shopping_agent.budget import request_deadline
+from .shopping_agent.resilience import upstream_stats
+from .shopping_agent.metrics import track_request, render_metrics
+from .shopping_agent.intent import get_intent_classifier, INTENT_FAST_PATH_ENABLED
+from .clients import get_clients, close_clients
+from .anaf_registry import get_company_registry
+from .jobs import WorkerPool, get_job_queue
+from .whatsapp import enqueue_whatsapp_message, JOB_HANDLERS
+from .shopping_agent.sessions import get_session_graph, session_config, expire_idle_session, close_session_store
+
+# WhatsApp messages are normally answered by separate worker processes (`python -m backend.worker`).
+# A value above 0 also runs a worker pool of that size inside the web process, e.g. for development.
+WHATSAPP_EMBEDDED_WORKERS = int(os.getenv("WHATSAPP_EMBEDDED_WORKERS", "0"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Migrates the database and creates the shared upstream clients at startup,
+    and closes them, the session store and the database pool at shutdown.
+    """
+    if DB_MIGRATE_ON_STARTUP:
+        # The schema is managed by the Alembic migrations (alembic/versions), whatever the backend.
+        await run_blocking(run_migrations)
+    get_clients()
+    if INTENT_FAST_PATH_ENABLED:
+        # Trained here so that the first request does not pay for it.
+        await run_blocking(get_intent_classifier)
+
+    embedded_pool = None
+    if WHATSAPP_EMBEDDED_WORKERS > 0:
+        embedded_pool = WorkerPool(get_job_queue(), JOB_HANDLERS, concurrency=WHATSAPP_EMBEDDED_WORKERS)
+        embedded_task = asyncio.create_task(embedded_pool.run())
+    yield
+    if embedded_pool is not None:
+        embedded_pool.stop()
+        await embedded_task
+    await close_session_store()
+    await close_clients()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Local Commerce API",
-    description="An API for finding clothing from local small businesses and more."
+    description="An API for finding clothing from local small businesses and more.",
+    lifespan=lifespan,
     )
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 
 # --- Database Initialization ---
 # Import your models and the engine from the correct locations
 from . import models, schemas, crud
-from .database import get_db, engine, DATABASE_URL
-
-# Extract the filename from the database URL
-db_file = DATABASE_URL.split("///")[-1]
-
-# Create the database and tables only if the file doesn't exist
-if not os.path.exists(db_file):
-    print(f"Database file not found at '{db_file}'. Creating database and tables...")
-    models.Base.metadata.create_all(bind=engine)
+from .database import get_async_db, async_engine, run_migrations, DB_MIGRATE_ON_STARTUP
 
 from . import security
 
@@ -65,6 +101,16 @@ class ShoppingRequest(BaseModel):
     user_query: str
     latitude: float
     longitude: float
+    # Optional client-chosen id: follow-up queries with the same id refine the previous search.
+    session_id: Optional[str] = None
+
+async def _graph_for(request: ShoppingRequest):
+    """Returns the graph and run config for a request: checkpointed per session when it has one."""
+    if not request.session_id:
+        return shopping_graph, None
+    thread_id = f"web:{request.session_id}"
+    await expire_idle_session(thread_id)
+    return await get_session_graph(), session_config(thread_id)
 
 @app.post("/shopping-assistant")
 async def run_shopping_assistant(request: ShoppingRequest):
@@ -74,68 +120,103 @@ async def run_shopping_assistant(request: ShoppingRequest):
     initial_state = {
         "user_query": request.user_query,
         "user_location": {"lat": request.latitude, "lng": request.longitude},
-        "messages": [("user", request.user_query)]
+        "messages": [("user", request.user_query)],
+        "deadline": request_deadline("web"),
     }
 
-    final_state = await shopping_graph.ainvoke(initial_state)
+    graph, config = await _graph_for(request)
+    with track_request("web"):
+        final_state = await graph.ainvoke(initial_state, config)
     final_message = final_state["messages"][-1]
 
     # Split the response content by newlines to create a list of strings.
     # This is a safer way for the frontend to handle multi-line text.
     response_lines = final_message.content.split('\n')
 
-    return {"response_lines": response_lines}
-
-async def process_whatsapp_message(user_query: str, from_number: str):
+    # `partial` is true when the time budget ran out before every shop was checked.
+    return {"response_lines": response_lines, "partial": bool(final_state.get("partial"))}
+
+def _sse(event: str, data: dict) -> str:
+    """Formats a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _progress_event(node: str, output: dict):
+    """Translates the output of a graph node into a progress event, if it is worth reporting."""
+    if not isinstance(output, dict):
+        return None
+    if node in ("fast_classify", "analyze_query") and "is_clothing_query" in output:
+        return {"stage": "classified", "is_clothing_query": output["is_clothing_query"], "search_keywords": output.get("search_keywords")}
+    if node == "check_response_cache" and output.get("response_cached"):
+        return {"stage": "cached"}
+    if node == "find_businesses":
+        return {"stage": "businesses_found", "count": len(output.get("businesses", []))}
+    if node == "search_for_product":
+        verified = [b for b in output.get("businesses", []) if b.get("product_url")]
+        return {"stage": "products_searched", "verified": len(verified)}
+    return None
+
+async def _stream_shopping_events(initial_state: dict, graph=shopping_graph, config: Optional[dict] = None):
     """
-    This function contains the agent logic and will be run in the background.
+    Runs the shopping graph and yields progress events per node, the synthesizer's
+    tokens as they are generated, and finally the same `response_lines` as the blocking endpoint.
     """
-    logger.info(f"Processing background task for {from_number} with query: '{user_query}'")
-    # --- Twilio Configuration ---
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-    twilio_phone_number = os.getenv("TWILIO_PHONE_NUMBER")
-
-    if not all([account_sid, auth_token, twilio_phone_number]):
-        logger.error("Twilio credentials are not configured in .env file.")
-        return # Stop execution if Twilio is not configured
+    final_state = None
+    try:
+        with track_request("web_stream"):
+            async for event in graph.astream_events(initial_state, config, version="v2"):
+                kind = event["event"]
+                node = event.get("metadata", {}).get("langgraph_node")
+
+                if kind == "on_chat_model_stream" and node == "synthesize_response":
+                    text = event["data"]["chunk"].content
+                    if text:
+                        yield _sse("token", {"text": text})
+                elif kind == "on_custom_event" and event["name"] == "product_verified":
+                    yield _sse("progress", {"stage": "product_verified", **event["data"]})
+                elif kind == "on_chain_end" and event["name"] == node:
+                    progress = _progress_event(node, event["data"].get("output"))
+                    if progress:
+                        yield _sse("progress", progress)
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    final_state = event["data"].get("output")
+    except Exception as e:
+        logger.error(f"Error while streaming the shopping assistant: {e}")
+        yield _sse("error", {"detail": "The shopping assistant failed to answer."})
+        return
 
-    # Since we can't get GPS from WhatsApp, we use a default location.
-    default_location = {
-        "lat": 44.4268,  # Bucharest latitude
-        "lng": 26.1025,  # Bucharest longitude
-    }
+    final_message = final_state["messages"][-1]
+    yield _sse("done", {"response_lines": final_message.content.split('\n'), "partial": bool(final_state.get("partial"))})
 
+@app.post("/shopping-assistant/stream")
+async def stream_shopping_assistant(request: ShoppingRequest):
+    """
+    Streaming variant of /shopping-assistant using Server-Sent Events.
+    Emits `progress` events (classified, businesses_found, product_verified, ...),
+    `token` events with the answer as it is written, then a final `done` event.
+    """
     initial_state = {
-        "user_query": user_query,
-        "user_location": default_location,
-        "messages": [("user", user_query)]
+        "user_query": request.user_query,
+        "user_location": {"lat": request.latitude, "lng": request.longitude},
+        "messages": [("user", request.user_query)],
+        "deadline": request_deadline("web"),
     }
-
-    try:
-        # Run the shopping agent graph
-        final_state = await shopping_graph.ainvoke(initial_state)
-        final_message = final_state["messages"][-1]
-        response_text = final_message.content
-
-        # Send the reply via Twilio
-        client = TwilioClient(account_sid, auth_token)
-        client.messages.create(
-            from_=f'whatsapp:{twilio_phone_number}',
-            body=response_text,
-            to=from_number
-        )
-        logger.info(f"Successfully sent reply to {from_number}")
-    except Exception as e:
-        logger.error(f"Error processing agent or sending Twilio message for {from_number}: {e}")
+    graph, config = await _graph_for(request)
+    return StreamingResponse(
+        _stream_shopping_events(initial_state, graph, config),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/whatsapp-webhook")
-async def whatsapp_webhook(background_tasks: BackgroundTasks, Body: str = Form(...), From: str = Form(...)):
+async def whatsapp_webhook(Body: str = Form(...), From: str = Form(...), MessageSid: Optional[str] = Form(None)):
     """
     Handles incoming WhatsApp messages via Twilio webhook.
-    It immediately responds to Twilio and processes the message in the background.
+    The message is persisted in the job queue and answered by the worker pool,
+    so Twilio gets an immediate response however busy the agent is.
     """
-    background_tasks.add_task(process_whatsapp_message, Body, From)
+    job_id = await run_blocking(enqueue_whatsapp_message, Body, From, MessageSid)
+    if job_id is None:
+        logger.info(f"Ignoring redelivered WhatsApp message {MessageSid} from {From}")
 
     return {} # Return an empty response immediately
 
@@ -148,28 +229,48 @@ def read_root():
     """A simple endpoint to check if the API is running."""
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """
+    Node and upstream latencies, LLM calls, tokens and cost per node, cache hit rates
+    and circuit breaker state, in the Prometheus text format. Counted per process.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/upstreams")
+def read_upstreams():
+    """The circuit breaker state, retries, hedges and p95 latency of every upstream."""
+    return upstream_stats()
+
+@app.get("/api/companies/search")
+def search_companies(name: str, limit: int = 5):
+    """Companies of the local ANAF registry whose name resembles `name`, with their CUI, best first."""
+    return get_company_registry().search(name, limit=min(limit, 50))
+
+# The user routes are async: while they wait on the database or on password hashing they hold
+# no threadpool worker, which the sync endpoints and the agent's blocking calls keep for themselves.
 @app.post("/api/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Creează un utilizator nou.
     """
-    db_user_by_email = crud.get_user_by_email(db, email=user.email)
+    db_user_by_email = await crud.get_user_by_email_async(db, email=user.email)
     if db_user_by_email:
         raise HTTPException(status_code=400, detail="Email already registered")
 
     # Add a check for the phone number
-    db_user_by_phone = db.query(models.User).filter(models.User.phone_number == user.phone_number).first()
+    db_user_by_phone = await crud.get_user_by_phone_number_async(db, phone_number=user.phone_number)
     if db_user_by_phone:
         raise HTTPException(status_code=400, detail="Phone number already registered")
 
-    return crud.create_user(db=db, user=user)
+    return await crud.create_user_async(db=db, user=user)
 
 @app.post("/api/token", response_model=schemas.Token)
-def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(db: AsyncSession = Depends(get_async_db), form_data: OAuth2PasswordRequestForm = Depends()):
     """
     Autentifică utilizatorul și returnează un token de acces.
     """
-    user = crud.authenticate_user(db, email=form_data.username, password=form_data.password)
+    user = await crud.authenticate_user_async(db, email=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -181,7 +282,7 @@ def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2Passw
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/api/users/me/", response_model=schemas.User)
-def read_users_me(current_user: schemas.User = Depends(security.get_current_user)):
+async def read_users_me(current_user: schemas.User = Depends(security.get_current_user)):
     """
     Endpoint protejat care returnează datele utilizatorului curent.
     """
@@ -1,12 +1,15 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .database import get_db
+from .database import get_async_db
 from . import models, crud, schemas
 # --- Configuration ---
 # Ideal ar fi ca SECRET_KEY să fie citit dintr-o variabilă de mediu, nu hardcodat.
@@ -21,6 +24,11 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
 # Folosim argon2, standardul modern recomandat pentru hashing-ul parolelor.
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Argon2 is deliberately slow (tens of ms of CPU per hash). The async routes hash on this pool,
+# sized to the CPUs, so that signups and logins neither block the event loop nor take the
+# threads of the blocking I/O pool used by the shopping agent.
+PASSWORD_HASH_MAX_WORKERS = int(os.getenv("PASSWORD_HASH_MAX_WORKERS", str(os.cpu_count() or 2)))
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_MAX_WORKERS, thread_name_prefix="password-hash")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -40,7 +48,15 @@ def get_password_hash(password: str) -> str:
     """Returnează hash-ul pentru o parolă dată."""
     return pwd_context.hash(password)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """`verify_password` on the password hashing pool."""
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """`get_password_hash` on the password hashing pool."""
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, get_password_hash, password)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     """
     Decodifică token-ul, validează utilizatorul și îl returnează.
     Aceasta este dependența care va proteja rutele.
@@ -57,7 +73,7 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_email(db, email=email)
+    user = await crud.get_user_by_email_async(db, email=email)
     if user is None:
         raise credentials_exception
     return user
\ No newline at end of file
@@ -0,0 +1,39 @@
+import os
+import time
+from typing import Any, Dict, Optional
+
+# --- Request Budget Configuration ---
+# Total time (in seconds) a request may take, per channel. A web user is waiting for the page,
+# a WhatsApp user already got the webhook's empty reply and can wait longer for a better answer.
+REQUEST_BUDGETS: Dict[str, float] = {
+    "web": float(os.getenv("WEB_REQUEST_BUDGET", "30")),
+    "whatsapp": float(os.getenv("WHATSAPP_REQUEST_BUDGET", "90")),
+}
+DEFAULT_CHANNEL = "web"
+# Part of the budget kept for writing the answer: the search phases stop this many seconds early.
+SYNTHESIS_RESERVE = float(os.getenv("SYNTHESIS_RESERVE", "8"))
+# The answer always gets at least this long, even if the budget is already spent.
+SYNTHESIS_MIN_TIMEOUT = float(os.getenv("SYNTHESIS_MIN_TIMEOUT", "3"))
+
+def request_deadline(channel: Optional[str]) -> float:
+    """The wall-clock deadline of a request started now on the given channel."""
+    return time.time() + REQUEST_BUDGETS.get(channel or DEFAULT_CHANNEL, REQUEST_BUDGETS[DEFAULT_CHANNEL])
+
+def remaining(deadline: Optional[float]) -> float:
+    """Seconds left until the deadline; infinite without one."""
+    if deadline is None:
+        return float('inf')
+    return deadline - time.time()
+
+def search_deadline(state: Dict[str, Any]) -> Optional[float]:
+    """The deadline of the search phases, which leaves SYNTHESIS_RESERVE for the answer."""
+    deadline = state.get("deadline")
+    return deadline - SYNTHESIS_RESERVE if deadline is not None else None
+
+def call_timeout(deadline: Optional[float], cap: float) -> float:
+    """The timeout of an upstream call: its own cap, shortened to what is left of the budget."""
+    return max(min(cap, remaining(deadline)), 0.0)
+
+def out_of_budget(state: Dict[str, Any]) -> bool:
+    """True once the search phases have used up their part of the budget."""
+    return remaining(search_deadline(state)) <= 0
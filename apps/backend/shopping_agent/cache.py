@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Protocol, Tuple
+
+from .concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# --- Cache Configuration ---
+# "sqlite" persists entries across restarts, "memory" keeps them only for the process lifetime.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+# Stored next to localcommerce.db by default.
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "./agent_cache.db")
+# Number of entries kept in the in-process LRU layer of every cache.
+CACHE_LRU_SIZE = int(os.getenv("CACHE_LRU_SIZE", "2048"))
+
+# --- Backends ---
+class CacheBackend(Protocol):
+    """Storage used behind a TTLCache. Values must be JSON-serializable."""
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Returns (value, stored_at) or None if the key is unknown."""
+        ...
+
+    def set(self, key: str, value: Any, stored_at: float) -> None:
+        ...
+
+    def delete(self, key: str) -> None:
+        ...
+
+class InMemoryCacheBackend:
+    """A backend that keeps entries in a plain dictionary."""
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Any, float]] = {}
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        return self._entries.get(key)
+
+    def set(self, key: str, value: Any, stored_at: float) -> None:
+        self._entries[key] = (value, stored_at)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+class SQLiteCacheBackend:
+    """A backend that persists entries as JSON in a SQLite table."""
+    def __init__(self, path: str, table: str):
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode, commits are not fsynced one by one; a crash may only lose the last entries.
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, stored_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), stored_at)
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+def create_cache_backend(table: str) -> CacheBackend:
+    """Creates the backend selected by CACHE_BACKEND for the given table."""
+    if CACHE_BACKEND == "memory":
+        return InMemoryCacheBackend()
+    if CACHE_BACKEND == "sqlite":
+        return SQLiteCacheBackend(CACHE_DB_PATH, table)
+    raise ValueError(f"Unknown CACHE_BACKEND '{CACHE_BACKEND}'. Use 'sqlite' or 'memory'.")
+
+# --- Cache ---
+# Every cache created in the process, by name.
+CACHES: Dict[str, "TTLCache"] = {}
+
+class TTLCache:
+    """
+    A cache with a time-to-live, an in-process LRU layer and hit/miss counters,
+    in front of a (possibly persistent) backend.
+    """
+    def __init__(self, name: str, backend: CacheBackend, ttl: float, lru_size: int = CACHE_LRU_SIZE):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return time.time() - stored_at < self.ttl
+
+    def get(self, key: str, record_stats: bool = True) -> Optional[Any]:
+        """
+        Returns the cached value, or None if it is missing or expired.
+        Callers probing several keys for one logical lookup can pass
+        record_stats=False and report the outcome with `record()`.
+        Blocking on an LRU miss; code running on the event loop uses `aget`.
+        """
+        entry = self._lru_get(key)
+        if entry is None:
+            entry = self._backend_get(key)
+        return self._result(entry, record_stats)
+
+    async def aget(self, key: str, record_stats: bool = True) -> Optional[Any]:
+        """Like `get`, reading the backend on the blocking I/O pool instead of the event loop."""
+        entry = self._lru_get(key)
+        if entry is None:
+            if isinstance(self.backend, InMemoryCacheBackend):
+                entry = self._backend_get(key)
+            else:
+                entry = await run_blocking(self._backend_get, key)
+        return self._result(entry, record_stats)
+
+    def _lru_get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+        return entry
+
+    def _backend_get(self, key: str) -> Optional[Tuple[Any, float]]:
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Cache '{self.name}' backend read failed for '{key}': {e}")
+            entry = None
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def _result(self, entry: Optional[Tuple[Any, float]], record_stats: bool) -> Optional[Any]:
+        if entry is not None and self._is_fresh(entry[1]):
+            if record_stats:
+                self.record(hit=True)
+            return entry[0]
+        if record_stats:
+            self.record(hit=False)
+        return None
+
+    def record(self, hit: bool) -> None:
+        """Counts a lookup as a hit or a miss."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def set(self, key: str, value: Any) -> None:
+        """Stores a value in both layers. Blocking; code running on the event loop uses `aset`."""
+        entry = (value, time.time())
+        self._remember(key, entry)
+        self._backend_set(key, entry)
+
+    async def aset(self, key: str, value: Any) -> None:
+        """Like `set`, writing the backend on the blocking I/O pool instead of the event loop."""
+        entry = (value, time.time())
+        self._remember(key, entry)
+        if isinstance(self.backend, InMemoryCacheBackend):
+            self._backend_set(key, entry)
+        else:
+            await run_blocking(self._backend_set, key, entry)
+
+    def _backend_set(self, key: str, entry: Tuple[Any, float]) -> None:
+        try:
+            self.backend.set(key, entry[0], entry[1])
+        except Exception as e:
+            logger.warning(f"Cache '{self.name}' backend write failed for '{key}': {e}")
+
+    def _remember(self, key: str, entry: Tuple[Any, float]) -> None:
+        with self._lock:
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the hit/miss counters of this cache."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "lru_entries": len(self._lru),
+        }
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns the counters of all caches."""
+    return {name: cache.stats() for name, cache in CACHES.items()}
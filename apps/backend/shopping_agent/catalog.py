@@ -0,0 +1,127 @@
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from .geo import EARTH_RADIUS_M, distance_m
+
+logger = logging.getLogger(__name__)
+
+# --- Catalog Configuration ---
+LOCAL_CATALOG_PATH = os.getenv("LOCAL_CATALOG_PATH", "./business_catalog.db")
+
+class BusinessCatalog:
+    """
+    A persistent catalog of the businesses seen in past Places responses,
+    indexed with a SQLite R-tree for radius-bounded nearest-neighbour lookups.
+    """
+    def __init__(self, path: str = LOCAL_CATALOG_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS businesses (
+                    id INTEGER PRIMARY KEY,
+                    place_id TEXT UNIQUE NOT NULL,
+                    name TEXT,
+                    address TEXT,
+                    rating REAL,
+                    website TEXT,
+                    score INTEGER,
+                    lat REAL NOT NULL,
+                    lng REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS businesses_rtree USING rtree(
+                    id, min_lat, max_lat, min_lng, max_lng
+                );
+            """)
+            self._conn.commit()
+
+    def upsert(self, businesses: List[Dict]) -> int:
+        """Adds or refreshes businesses that have a place_id and a location. Returns how many were stored."""
+        now = time.time()
+        stored = 0
+        with self._lock:
+            for b in businesses:
+                location = b.get("location")
+                if not b.get("place_id") or not location:
+                    continue
+                row_id = self._conn.execute(
+                    """
+                    INSERT INTO businesses (place_id, name, address, rating, website, score, lat, lng, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(place_id) DO UPDATE SET
+                        name = excluded.name, address = excluded.address, rating = excluded.rating,
+                        website = excluded.website, score = excluded.score,
+                        lat = excluded.lat, lng = excluded.lng, updated_at = excluded.updated_at
+                    RETURNING id
+                    """,
+                    (b["place_id"], b.get("name"), b.get("address"), b.get("rating", 0), b.get("website"),
+                     b.get("score"), location["lat"], location["lng"], now)
+                ).fetchone()[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO businesses_rtree (id, min_lat, max_lat, min_lng, max_lng) VALUES (?, ?, ?, ?, ?)",
+                    (row_id, location["lat"], location["lat"], location["lng"], location["lng"])
+                )
+                stored += 1
+            self._conn.commit()
+        return stored
+
+    def nearest(self, location: Dict[str, float], radius: float, k: int) -> List[Dict]:
+        """
+        Returns up to k businesses within `radius` meters of `location`, nearest first.
+        Every result carries its `distance` (meters) and `updated_at` timestamp.
+        """
+        # Bounding box of the search circle, used to prune the R-tree.
+        d_lat = math.degrees(radius / EARTH_RADIUS_M)
+        d_lng = math.degrees(radius / (EARTH_RADIUS_M * max(math.cos(math.radians(location["lat"])), 1e-6)))
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT b.place_id, b.name, b.address, b.rating, b.website, b.score, b.lat, b.lng, b.updated_at
+                FROM businesses_rtree r JOIN businesses b ON b.id = r.id
+                WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lng >= ? AND r.max_lng <= ?
+                """,
+                (location["lat"] - d_lat, location["lat"] + d_lat, location["lng"] - d_lng, location["lng"] + d_lng)
+            ).fetchall()
+
+        candidates = []
+        for place_id, name, address, rating, website, score, lat, lng, updated_at in rows:
+            business_location = {"lat": lat, "lng": lng}
+            distance = distance_m(location, business_location)
+            if distance > radius:
+                continue
+            candidates.append({
+                "name": name,
+                "address": address,
+                "rating": rating,
+                "maps_url": f"https://www.google.com/maps/place/?q=place_id:{place_id}",
+                "place_id": place_id,
+                "website": website,
+                "score": score,
+                "location": business_location,
+                "distance": distance,
+                "updated_at": updated_at,
+            })
+        candidates.sort(key=lambda b: b["distance"])
+        return candidates[:k]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM businesses").fetchone()[0]
+
+_catalog: Optional[BusinessCatalog] = None
+_catalog_lock = threading.Lock()
+
+def get_business_catalog() -> BusinessCatalog:
+    """Returns the process-wide catalog, opening it on first use (from any thread)."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = BusinessCatalog()
+        return _catalog
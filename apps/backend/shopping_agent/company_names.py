@@ -0,0 +1,136 @@
+import re
+import zlib
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .text import normalize_text
+
+# --- Normalization ---
+# Legal forms and prefixes of Romanian companies, as they read once dots and spaces are removed
+# ("S.R.L.", "s. r. l." and "SRL" all become "srl"). They say nothing about which company it is.
+LEGAL_FORMS = {
+    "sc", "srl", "srld", "sa", "sca", "scs", "snc", "pfa", "ii", "if", "ra", "scm", "ong", "coop",
+    "societate", "comerciala", "intreprindere", "individuala", "familiala",
+}
+# Character n-grams of every word, so that typos and word order barely change the signature.
+NGRAM_SIZES = (3,)
+
+def normalize_company_name(name: str) -> str:
+    """
+    Lowercases, strips diacritics, punctuation and legal forms
+    (e.g. "S.C. Atelier Ilincă S.R.L." -> "atelier ilinca").
+    """
+    text = normalize_text(name).replace("&", " si ").replace("srl-d", "srld").replace(".", "")
+    words = re.findall(r"[a-z0-9]+", text)
+
+    # Join the letters of spaced abbreviations: "s r l" -> "srl".
+    merged: List[str] = []
+    run = ""
+    for word in words + [""]:
+        if len(word) == 1:
+            run += word
+            continue
+        if run:
+            merged.append(run)
+            run = ""
+        if word:
+            merged.append(word)
+    return " ".join(w for w in merged if w not in LEGAL_FORMS)
+
+def name_signature(name: str) -> Dict[int, float]:
+    """The L2-normalized bag of hashed words and word n-grams of a name."""
+    words = normalize_company_name(name).split()
+    grams = [f"w:{w}" for w in words]
+    for word in words:
+        padded = f"_{word}_"
+        for n in NGRAM_SIZES:
+            grams.extend(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+
+    counts: Dict[int, float] = {}
+    for gram in grams:
+        key = zlib.crc32(gram.encode("utf-8"))
+        counts[key] = counts.get(key, 0.0) + 1.0
+    norm = sum(c * c for c in counts.values()) ** 0.5
+    return {key: count / norm for key, count in counts.items()} if norm else {}
+
+def name_similarity(a: str, b: str) -> float:
+    """Cosine similarity of two names' signatures, between 0 and 1."""
+    sig_a, sig_b = name_signature(a), name_signature(b)
+    if len(sig_b) < len(sig_a):
+        sig_a, sig_b = sig_b, sig_a
+    return sum(weight * sig_b.get(key, 0.0) for key, weight in sig_a.items())
+
+class NameIndex:
+    """
+    The signatures of many candidate names, stored as an inverted index over their n-grams,
+    so that one name is scored against every candidate in a single vectorized pass.
+    """
+    def __init__(self, names: Sequence[str]):
+        self.names = list(names)
+        keys, rows, weights = [], [], []
+        for row, name in enumerate(self.names):
+            for key, weight in name_signature(name).items():
+                keys.append(key)
+                rows.append(row)
+                weights.append(weight)
+
+        order = np.argsort(np.asarray(keys, dtype=np.int64), kind="stable")
+        sorted_keys = np.asarray(keys, dtype=np.int64)[order]
+        self._rows = np.asarray(rows, dtype=np.int64)[order]
+        self._weights = np.asarray(weights, dtype=np.float32)[order]
+        # Posting list of every n-gram: _rows[_starts[i]:_ends[i]] for the key _keys[i].
+        self._keys, self._starts = np.unique(sorted_keys, return_index=True)
+        self._ends = np.append(self._starts[1:], len(sorted_keys))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def scores(self, name: str) -> np.ndarray:
+        """The similarity of `name` to every candidate, in candidate order."""
+        signature = name_signature(name)
+        # No n-grams on either side (e.g. only legal forms such as "SRL"): nothing can match.
+        if not signature or not len(self._keys):
+            return np.zeros(len(self.names), dtype=np.float32)
+
+        query_keys = np.fromiter(signature.keys(), dtype=np.int64, count=len(signature))
+        query_weights = np.fromiter(signature.values(), dtype=np.float32, count=len(signature))
+        positions = np.searchsorted(self._keys, query_keys)
+        positions = np.minimum(positions, len(self._keys) - 1)
+        present = self._keys[positions] == query_keys
+        positions, query_weights = positions[present], query_weights[present]
+        if not len(positions):
+            return np.zeros(len(self.names), dtype=np.float32)
+
+        starts, ends = self._starts[positions], self._ends[positions]
+        lengths = ends - starts
+        # Indices of every posting of the query's n-grams, gathered without a Python loop.
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        contributions = self._weights[offsets] * np.repeat(query_weights, lengths)
+        return np.bincount(self._rows[offsets], weights=contributions, minlength=len(self.names)).astype(np.float32)
+
+    def best(self, name: str) -> Tuple[int, float]:
+        """The index and similarity of the candidate closest to `name` (-1 without candidates)."""
+        if not len(self.names):
+            return -1, 0.0
+        scores = self.scores(name)
+        index = int(np.argmax(scores))
+        return index, float(scores[index])
+
+    def top(self, name: str, k: int = 5, threshold: float = 0.0) -> List[Tuple[int, float]]:
+        """Up to k (index, similarity) pairs of the closest candidates, best first."""
+        scores = self.scores(name)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        indices = np.argpartition(-scores, k - 1)[:k]
+        indices = indices[np.argsort(-scores[indices])]
+        return [(int(i), float(scores[i])) for i in indices if scores[i] >= threshold]
+
+    def match_all(self, names: Sequence[str], threshold: float) -> List[Tuple[int, float]]:
+        """The best candidate of each name, or (-1, score) when it is below the threshold."""
+        matches = []
+        for name in names:
+            index, score = self.best(name)
+            matches.append((index if score >= threshold else -1, score))
+        return matches
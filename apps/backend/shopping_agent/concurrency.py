@@ -0,0 +1,36 @@
+import os
+import asyncio
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+# --- Concurrency Configuration ---
+# Upper bound of in-flight calls per upstream service, shared by every request
+# running on the same event loop. Tune them to the rate limits of each API key.
+UPSTREAM_CONCURRENCY_LIMITS: Dict[str, int] = {
+    "tavily": int(os.getenv("TAVILY_MAX_CONCURRENCY", "10")),
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "10")),
+}
+
+# Semaphores are bound to the event loop that first waits on them, so we keep
+# one set per loop (uvicorn, background workers and scripts may each run their own).
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+def upstream_limit(upstream: str) -> asyncio.Semaphore:
+    """Returns the semaphore limiting concurrent calls to the given upstream."""
+    loop = asyncio.get_running_loop()
+    loop_semaphores = _semaphores.setdefault(loop, {})
+    if upstream not in loop_semaphores:
+        loop_semaphores[upstream] = asyncio.Semaphore(UPSTREAM_CONCURRENCY_LIMITS[upstream])
+    return loop_semaphores[upstream]
+
+# Bounded pool for the clients that have no async API (Google Maps, Twilio), so that
+# they never block the event loop and a burst of requests cannot spawn unbounded threads.
+BLOCKING_IO_MAX_WORKERS = int(os.getenv("BLOCKING_IO_MAX_WORKERS", "32"))
+_blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_MAX_WORKERS, thread_name_prefix="blocking-io")
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking call on the bounded I/O thread pool and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,84 @@
+import math
+from typing import Dict, List, Tuple
+
+# --- Geohash Tiles ---
+# A geohash splits the world into a grid of base32-named tiles; every extra character
+# makes the tile 32 times smaller (precision 6 is roughly 1.2km x 0.6km).
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_M = 6371000.0
+
+def encode_geohash(lat: float, lng: float, precision: int) -> str:
+    """Returns the geohash of the tile containing the given point."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        value_range, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(geohash)
+
+def decode_geohash_bounds(geohash: str) -> Tuple[float, float, float, float]:
+    """Returns the (min_lat, max_lat, min_lng, max_lng) bounds of a tile."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lng_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if (bits >> shift) & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+def tile_center(geohash: str) -> Dict[str, float]:
+    """Returns the center point of a tile, in the {"lat", "lng"} format used by Google Maps."""
+    min_lat, max_lat, min_lng, max_lng = decode_geohash_bounds(geohash)
+    return {"lat": (min_lat + max_lat) / 2, "lng": (min_lng + max_lng) / 2}
+
+def tile_diagonal_m(geohash: str) -> float:
+    """Returns the length of a tile's diagonal, in meters."""
+    min_lat, max_lat, min_lng, max_lng = decode_geohash_bounds(geohash)
+    return haversine_m(min_lat, min_lng, max_lat, max_lng)
+
+def neighbor_tiles(geohash: str) -> List[str]:
+    """Returns the (up to) 8 tiles surrounding the given one."""
+    min_lat, max_lat, min_lng, max_lng = decode_geohash_bounds(geohash)
+    lat_step, lng_step = max_lat - min_lat, max_lng - min_lng
+    center = tile_center(geohash)
+    neighbors = []
+    for d_lat in (-1, 0, 1):
+        for d_lng in (-1, 0, 1):
+            if d_lat == 0 and d_lng == 0:
+                continue
+            lat = center["lat"] + d_lat * lat_step
+            if not -90.0 <= lat <= 90.0:
+                continue
+            lng = (center["lng"] + d_lng * lng_step + 180.0) % 360.0 - 180.0
+            neighbors.append(encode_geohash(lat, lng, len(geohash)))
+    return neighbors
+
+# --- Distances ---
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Returns the great-circle distance between two points, in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+def distance_m(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """Distance between two {"lat", "lng"} points, in meters."""
+    return haversine_m(a["lat"], a["lng"], b["lat"], b["lng"])
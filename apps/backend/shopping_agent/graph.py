@@ -1,10 +1,28 @@
 import os
-from typing import TypedDict, Annotated, List
-from langchain_core.messages import BaseMessage, SystemMessage
+import time
+import asyncio
+import logging
+from typing import TypedDict, Annotated, List, Optional
+from langchain_core.callbacks.manager import adispatch_custom_event
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 
-from .tools import find_local_businesses, search_product_at_store, Business
+from ..clients import get_clients
+from .tools import find_local_businesses, search_product_at_store, Business, NEARBY_TILE_PRECISION
+from .catalog import get_business_catalog
+from .concurrency import run_blocking
+from .geo import encode_geohash
+from .resilience import call_upstream
+from .metrics import instrument_node, llm_usage_callback
+from .response_cache import response_cache, RESPONSE_CACHE_ENABLED
+from .verification import verify_in_batches, VerificationBatch, PRODUCT_VERIFICATION_MODE
+from .text import normalize_text
+from .intent import get_intent_classifier, extract_locally, INTENT_FAST_PATH_ENABLED
+from .budget import search_deadline, remaining, call_timeout, out_of_budget, SYNTHESIS_MIN_TIMEOUT
 from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
 
 # --- Agent State ---
 class ShoppingAgentState(TypedDict):
@@ -16,115 +34,397 @@ class ShoppingAgentState(TypedDict):
     attributes: List[str] # The product attributes
     businesses: List[Business]
     is_clothing_query: bool # To store the classification result
+    response_cached: bool # True when the answer was served from the response cache
+    intent_decided_locally: bool # True when the local classifier skipped the LLM analysis
+    businesses_tile: str # Geohash tile of the location the businesses were found for
+    previous_main_product: str # In a session: the main product of the previous search
+    previous_attributes: List[str] # In a session: the attributes of the previous search
+    deadline: Optional[float] # Wall-clock time by which the answer must be sent (see `budget.py`)
+    partial: bool # True when the budget ran out before the search was complete
+    upstream_error: Optional[str] # The first upstream failure of the run; such answers are not cached
+
+class QueryAnalysis(BaseModel):
+    """The classification and the search terms of a user query."""
+    is_clothing_query: bool = Field(description="True only if the query explicitly states an intention to search for or buy a clothing item.")
+    main_product: str = Field(default="", description="The main product, e.g. \"jachetă\". Empty if not a clothing query.")
+    attributes: List[str] = Field(default_factory=list, description="The product attributes, e.g. [\"neagră\", \"de piele\"].")
+    search_keywords: str = Field(default="", description="The full search term, e.g. \"jachetă neagră de piele\".")
 
 # --- LLM Configuration ---
 # Ensure you have OPENAI_API_KEY set in your .env file
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+# Every call goes through the shared, pooled HTTP client instead of a default one per model.
+# Retries are left to `resilience.py`, which shares a retry budget with the other upstream calls.
+# Token usage (streamed answers included) is counted per node by `metrics.py`.
+llm = ChatOpenAI(
+    model="gpt-4o", temperature=0, max_retries=0, stream_usage=True,
+    http_async_client=get_clients().openai_http, callbacks=[llm_usage_callback]
+)
+# Returns a validated QueryAnalysis instead of free-form text.
+analysis_llm = llm.with_structured_output(QueryAnalysis)
+verification_llm = llm.with_structured_output(VerificationBatch)
+
+# Maximum time (in seconds) spent searching and verifying a single business.
+PRODUCT_SEARCH_TIMEOUT = float(os.getenv("PRODUCT_SEARCH_TIMEOUT", "45"))
+# Maximum time (in seconds) of the query analysis, the business search and the answer.
+QUERY_ANALYSIS_TIMEOUT = float(os.getenv("QUERY_ANALYSIS_TIMEOUT", "20"))
+BUSINESS_SEARCH_TIMEOUT = float(os.getenv("BUSINESS_SEARCH_TIMEOUT", "30"))
+SYNTHESIS_TIMEOUT = float(os.getenv("SYNTHESIS_TIMEOUT", "30"))
+
+# --- Top-k Product Search Configuration ---
+# Number of recommendations in the answer.
+PRODUCT_SEARCH_TOP_K = int(os.getenv("PRODUCT_SEARCH_TOP_K", "3"))
+# Shops are searched in waves, in the order the answer ranks them (lowest score first), until
+# the top k are known. Every wave searches this many shops more than the hits still missing.
+PRODUCT_SEARCH_OVERFETCH = int(os.getenv("PRODUCT_SEARCH_OVERFETCH", "2"))
+
+# --- Local Catalog Configuration ---
+# Serve an area from the local catalog when it already knows this many businesses there.
+LOCAL_CATALOG_ENABLED = os.getenv("LOCAL_CATALOG_ENABLED", "true").lower() == "true"
+LOCAL_CATALOG_MIN_RESULTS = int(os.getenv("LOCAL_CATALOG_MIN_RESULTS", "10"))
+LOCAL_CATALOG_K = int(os.getenv("LOCAL_CATALOG_K", "20"))
+# Catalog entries older than this (in seconds) trigger a background refresh of the area.
+LOCAL_CATALOG_REFRESH_AGE = float(os.getenv("LOCAL_CATALOG_REFRESH_AGE", str(24 * 3600)))
+# Background refreshes in flight, by geohash tile.
+_catalog_refreshes: dict = {}
 
 # --- Agent Nodes ---
 def initialize_state_node(state: ShoppingAgentState):
-    """Placeholder for any future initializations."""
-    return {}
+    """
+    Starts a run. In a session (see `sessions.py`) the state still holds the previous
+    search, which is set aside so that a follow-up can refine it. A search answered from
+    the response cache has no businesses; it can still be refined, they are just not reused
+    (see `can_reuse_businesses`).
+    """
+    if state.get("main_product"):
+        return {"previous_main_product": state["main_product"], "previous_attributes": state.get("attributes") or [],
+                "partial": False, "upstream_error": None}
+    return {"previous_main_product": "", "previous_attributes": [], "partial": False, "upstream_error": None}
 
-def query_classifier_node(state: ShoppingAgentState):
+def intent_fast_path_node(state: ShoppingAgentState):
     """
-    Classifies if the user query is about buying clothing.
+    Classifies the query with the local lexicon and linear model. Confident
+    decisions skip the LLM; ambiguous queries are left to `query_analyzer_node`.
     """
+    if not INTENT_FAST_PATH_ENABLED:
+        return {"intent_decided_locally": False}
+
     user_query = state["user_query"]
-    
-    classification_prompt = f"""
-    Does the following user query explicitly state an intention to search for or buy a clothing item?
-    Answer with only "yes" or "no".
+    decision, probability = get_intent_classifier().classify(user_query)
+    if decision is None:
+        logger.info(f"Intent of '{user_query}' is ambiguous (p={probability:.2f}), asking the LLM")
+        return {"intent_decided_locally": False}
+    if decision is False and state.get("previous_main_product"):
+        # Without a clothing word, "dar în albastru" may refine the previous search.
+        logger.info(f"'{user_query}' may refine the search for '{state['previous_main_product']}', asking the LLM")
+        return {"intent_decided_locally": False}
 
-    User query: "{user_query}"
-    """
-    
-    response = llm.invoke([SystemMessage(content=classification_prompt)])
-    answer = response.content.strip().lower()
-    
-    return {"is_clothing_query": "yes" in answer}
+    result = {"intent_decided_locally": True, "is_clothing_query": decision}
+    if decision:
+        extraction = extract_locally(user_query)
+        if extraction is None:
+            logger.info(f"No product could be extracted locally from '{user_query}', asking the LLM")
+            return {"intent_decided_locally": False}
+        result.update(extraction)
+    logger.info(f"Intent of '{user_query}' decided locally: is_clothing_query={decision} (p={probability:.2f})")
+    return result
 
-def query_extractor_node(state: ShoppingAgentState):
+async def query_analyzer_node(state: ShoppingAgentState):
     """
-    Extracts relevant search keywords from the user's query using an LLM.
+    Classifies if the user query is about buying clothing and extracts the
+    product, its attributes and the search keywords, in a single structured LLM call.
     """
     user_query = state["user_query"]
-    
-    extraction_prompt = f"""
-    From the following user query, extract the main product, its attributes, and the full search term.
-    Return a JSON object with three keys: "main_product", "attributes" (as a list of strings), and "search_keywords".
+
+    previous_search = ""
+    if state.get("previous_main_product"):
+        previous_search = f"""
+    The user previously searched for "{state['previous_main_product']}" with the attributes {state.get('previous_attributes', [])}.
+    If the query only changes or adds attributes (e.g. "dar în albastru"), it is a clothing query for the same product:
+    keep the main product and return the updated attributes and the full search term.
+    """
+
+    analysis_prompt = f"""
+    Does the following user query explicitly state an intention to search for or buy a clothing item?
+    If it does, also extract the main product, its attributes, and the full search term.
 
     Example:
     User query: "Vreau să cumpăr o jachetă neagră de piele."
-    Output: {{"main_product": "jachetă", "attributes": ["neagră", "de piele"], "search_keywords": "jachetă neagră de piele"}}
-    
+    Output: is_clothing_query=true, main_product="jachetă", attributes=["neagră", "de piele"], search_keywords="jachetă neagră de piele"
+    {previous_search}
     User query: "{user_query}"
     """
-    
-    response = llm.invoke([SystemMessage(content=extraction_prompt)])
-    import json
+
+    deadline = search_deadline(state)
+    timeout = call_timeout(deadline, QUERY_ANALYSIS_TIMEOUT)
     try:
-        extracted_data = json.loads(response.content)
-    except (json.JSONDecodeError, TypeError):
-        # Fallback if JSON parsing fails
-        extracted_data = {"search_keywords": user_query, "main_product": user_query.split()[0], "attributes": []}
+        analysis = await call_upstream(
+            "openai", lambda: analysis_llm.ainvoke([SystemMessage(content=analysis_prompt)]),
+            timeout=QUERY_ANALYSIS_TIMEOUT, deadline=deadline
+        )
+    except asyncio.TimeoutError:
+        # Without an analysis there is nothing to search: answer that no shop was found in time.
+        logger.warning(f"Query analysis timed out after {timeout:.1f}s for '{user_query}'")
+        return {"is_clothing_query": True, "search_keywords": user_query, "businesses": [], "partial": True}
+    return {
+        "is_clothing_query": analysis.is_clothing_query,
+        "main_product": analysis.main_product,
+        "attributes": analysis.attributes,
+        "search_keywords": analysis.search_keywords or user_query,
+    }
+
+def _refresh_catalog_in_background(state: ShoppingAgentState):
+    """Re-runs the live search for an area in the background, at most once at a time per tile."""
+    location = state["user_location"]
+    tile = encode_geohash(location["lat"], location["lng"], NEARBY_TILE_PRECISION)
+    if tile in _catalog_refreshes:
+        return
+
+    async def refresh():
+        try:
+            # Not bound by the budget of the request that triggered it.
+            await find_local_businesses({**state, "deadline": None})
+        finally:
+            _catalog_refreshes.pop(tile, None)
 
-    return extracted_data
+    _catalog_refreshes[tile] = asyncio.create_task(refresh())
+
+async def business_finder_node(state: ShoppingAgentState):
+    """
+    This node finds the businesses around the user. Areas with enough known
+    businesses are served from the local catalog and refreshed in the background.
+    """
+    if out_of_budget(state):
+        logger.warning("Request budget ran out before the business search")
+        return {"businesses": [], "businesses_tile": "", "partial": True}
 
-def business_finder_node(state: ShoppingAgentState):
-    """This node runs the tool to find businesses."""
     # Force a 5km radius search
     state["search_radius"] = 5000
-    tool_output = find_local_businesses(state)
-    return {"businesses": tool_output.get("businesses", [])}
+    tile = _businesses_tile(state)
+
+    if LOCAL_CATALOG_ENABLED and state.get("user_location"):
+        try:
+            # A SQLite query (and, on first use, opening the file): kept off the event loop.
+            known = await run_blocking(
+                lambda: get_business_catalog().nearest(state["user_location"], state["search_radius"], k=LOCAL_CATALOG_K)
+            )
+        except Exception as e:
+            logger.warning(f"Local business catalog lookup failed: {e}")
+            known = []
+        if len(known) >= LOCAL_CATALOG_MIN_RESULTS:
+            logger.info(f"Serving {len(known)} businesses from the local catalog")
+            if time.time() - min(b["updated_at"] for b in known) > LOCAL_CATALOG_REFRESH_AGE:
+                _refresh_catalog_in_background(state)
+            return {"businesses": known, "businesses_tile": tile}
+
+    timeout = call_timeout(search_deadline(state), BUSINESS_SEARCH_TIMEOUT)
+    try:
+        tool_output = await asyncio.wait_for(find_local_businesses(state), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Business search timed out after {timeout:.1f}s")
+        return {"businesses": [], "businesses_tile": "", "partial": True}
+    if tool_output.get("error"):
+        return {"businesses": [], "businesses_tile": "", "upstream_error": tool_output["error"]}
+    return {"businesses": tool_output.get("businesses", []), "businesses_tile": tile}
+
+def _businesses_tile(state: ShoppingAgentState) -> str:
+    location = state.get("user_location")
+    if not location:
+        return ""
+    return encode_geohash(location["lat"], location["lng"], NEARBY_TILE_PRECISION)
+
+def can_reuse_businesses(state: ShoppingAgentState) -> bool:
+    """
+    True when a session follow-up searches the same product in the same area,
+    so the businesses found for the previous query are still the right ones.
+    """
+    previous_product = state.get("previous_main_product")
+    return bool(
+        previous_product
+        and state.get("businesses")
+        and state.get("businesses_tile")
+        and state["businesses_tile"] == _businesses_tile(state)
+        and normalize_text(state.get("main_product", "")) == normalize_text(previous_product)
+    )
+
+async def _emit_progress(name: str, data: dict):
+    """Sends a custom event to `astream_events` listeners, such as the streaming endpoint."""
+    try:
+        await adispatch_custom_event(name, data)
+    except RuntimeError:
+        # Not running inside a graph run (e.g. the node is called directly).
+        pass
+
+async def _verify_search_result(search_keywords: str, result: dict) -> Optional[str]:
+    """
+    Asks the LLM whether a single search result sells the wanted product.
+    Returns the page URL if it does, otherwise None.
+    """
+    page_content = result.get("content", "")
+    page_url = result.get("url")
+
+    # Simplified validation: Does the page content match the wanted product?
+    verification_prompt = f"""
+    Based on the following text from a webpage, does it seem like the product "{search_keywords}" is available for sale?
+    Answer with only "yes" or "no".
+
+    Text: "{page_content}"
+    """
+    try:
+        response = await call_upstream("openai", lambda: llm.ainvoke([SystemMessage(content=verification_prompt)]))
+    except Exception as e:
+        logger.error(f"Verification failed for '{page_url}': {e}")
+        return None
+
+    answer = response.content.strip().lower()
+    return page_url if "yes" in answer else None
+
+async def _search_store(business: Business, search_keywords: str) -> List[dict]:
+    """Searches a single business's website for the product with Tavily."""
+    # Use the full search keywords for a more specific search on the site.
+    tavily_query = f'{search_keywords} site:{business.get("website")}'
+    search_response = await search_product_at_store(business["website"], tavily_query)
+    if search_response.get("error"):
+        # Collected by `product_search_node`: an answer missing this shop must not be cached.
+        business["search_error"] = search_response["error"]
+    return search_response.get("results", [])
 
-def product_search_node(state: ShoppingAgentState):
+async def _search_business(business: Business, search_keywords: str):
     """
-    Searches for the product on each business's website, validates it,
-    and calculates a similarity score.
+    Searches a single business's website and verifies the results concurrently.
+    The first verified result wins and the remaining checks are cancelled.
+    """
+    business["product_found"] = False
+    business["product_url"] = None
+
+    search_results = await _search_store(business, search_keywords)
+
+    checks = [asyncio.create_task(_verify_search_result(search_keywords, result)) for result in search_results]
+    try:
+        for next_check in asyncio.as_completed(checks):
+            page_url = await next_check
+            if page_url:
+                # If the LLM confirms the product is on the page, we consider it a valid result.
+                business["product_found"] = True
+                business["product_url"] = page_url
+                await _emit_progress("product_verified", {"name": business.get("name"), "product_url": page_url})
+                break
+    finally:
+        # Since we found a valid product (or gave up), stop checking other search results for this business.
+        for check in checks:
+            check.cancel()
+        await asyncio.gather(*checks, return_exceptions=True)
+
+async def _search_businesses_batched(businesses: List[Business], search_keywords: str, deadline: Optional[float] = None):
+    """
+    Searches every business's website concurrently, then verifies all the
+    results together in a few batched LLM calls.
+    """
+    async def search(business: Business) -> List[dict]:
+        business["product_found"] = False
+        business["product_url"] = None
+        timeout = call_timeout(deadline, PRODUCT_SEARCH_TIMEOUT)
+        try:
+            return await asyncio.wait_for(_search_store(business, search_keywords), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Product search timed out after {timeout:.1f}s for '{business.get('name')}'")
+            return []
+
+    results_per_business = await asyncio.gather(*(search(b) for b in businesses))
+    all_results = [result for results in results_per_business for result in results]
+    if not all_results:
+        return
+
+    timeout = call_timeout(deadline, PRODUCT_SEARCH_TIMEOUT)
+    try:
+        verdicts = await asyncio.wait_for(
+            verify_in_batches(verification_llm, search_keywords, all_results, fallback=_verify_search_result),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Product verification timed out after {timeout:.1f}s")
+        return
+
+    for business, results in zip(businesses, results_per_business):
+        # Keep the search engine's ranking: the first verified page of each shop wins.
+        for result in results:
+            if verdicts.get(result.get("url")):
+                business["product_found"] = True
+                business["product_url"] = result.get("url")
+                await _emit_progress("product_verified", {"name": business.get("name"), "product_url": business["product_url"]})
+                break
+
+def _ranking_key(business: Business) -> float:
+    """The order of the recommendations: smaller (lower score) businesses first."""
+    return business.get("score", float('inf'))
+
+async def _search_wave(businesses: List[Business], search_keywords: str, deadline: Optional[float] = None):
+    """
+    Searches and verifies a group of businesses concurrently, with the configured verification mode.
+    Every call is cut short at the deadline.
+    """
+    if PRODUCT_VERIFICATION_MODE == "batch":
+        await _search_businesses_batched(businesses, search_keywords, deadline)
+        return
+
+    async def search_with_timeout(business: Business):
+        timeout = call_timeout(deadline, PRODUCT_SEARCH_TIMEOUT)
+        try:
+            await asyncio.wait_for(_search_business(business, search_keywords), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Product search timed out after {timeout:.1f}s for '{business.get('name')}'")
+
+    await asyncio.gather(*(search_with_timeout(b) for b in businesses))
+
+async def product_search_node(state: ShoppingAgentState):
+    """
+    Searches for the product on the businesses' websites and validates it.
+    Shops are searched in score order, in concurrent waves, and the search stops once
+    PRODUCT_SEARCH_TOP_K shops are verified: every shop ranked before them has then
+    been checked, so the answer is the same as when searching all of them.
+    Calls to each upstream are bounded by the limits in `concurrency.py` and
+    protected by the breakers and retries of `resilience.py`.
+    By default the results are verified in batches (see `verification.py`).
+    When the request's budget runs out, the answer is written from the shops verified so far.
     """
     search_keywords = state["search_keywords"]
-    main_product = state["main_product"]
-    attributes = state["attributes"]
     businesses = state["businesses"]
-    
     for business in businesses:
-        if business.get("website"):
-            business["product_found"] = False
-            business["product_url"] = None
-
-            # Use the full search keywords for a more specific search on the site.
-            tavily_query = f'{search_keywords} site:{business.get("website")}'
-            search_response = search_product_at_store(business["website"], tavily_query)
-            search_results = search_response.get("results", [])
-
-            for result in search_results:
-                page_content = result.get("content", "")
-                page_url = result.get("url")
-
-                # Simplified validation: Does the page content match the wanted product?
-                verification_prompt = f"""
-                Based on the following text from a webpage, does it seem like the product "{search_keywords}" is available for sale?
-                Answer with only "yes" or "no".
-
-                Text: "{page_content}"
-                """
-                response = llm.invoke([SystemMessage(content=verification_prompt)])
-                answer = response.content.strip().lower()
-                
-                if "yes" in answer:
-                    # If the LLM confirms the product is on the page, we consider it a valid result.
-                    business["product_found"] = True
-                    business["product_url"] = page_url
-                    # Since we found a valid product, we can stop checking other search results for this business.
-                    break
-
-    return {"businesses": businesses}
-
-def response_synthesizer_node(state: ShoppingAgentState):
+        # Businesses reused from a previous search may still carry its results.
+        business["product_found"] = False
+        business["product_url"] = None
+        business.pop("search_error", None)
+
+    pending = sorted((b for b in businesses if b.get("website")), key=_ranking_key)
+    deadline = search_deadline(state)
+    found = searched = 0
+    partial = False
+    while pending and found < PRODUCT_SEARCH_TOP_K:
+        # No new wave once the search part of the request's budget is spent.
+        if remaining(deadline) <= 0:
+            logger.warning(f"Request budget ran out after {searched} shops, answering with {found} verified")
+            partial = True
+            break
+        wave_size = PRODUCT_SEARCH_TOP_K - found + PRODUCT_SEARCH_OVERFETCH
+        wave, pending = pending[:wave_size], pending[wave_size:]
+        await _search_wave(wave, search_keywords, deadline)
+        searched += len(wave)
+        found += sum(1 for b in wave if b.get("product_url"))
+    # Calls cut short by the budget leave the wave unfinished too.
+    partial = partial or (found < PRODUCT_SEARCH_TOP_K and out_of_budget(state)) or bool(state.get("partial"))
+
+    logger.info(f"Found the product at {found} of {searched} searched shops ({len(pending)} left unsearched)")
+    errors = [b.pop("search_error") for b in businesses if "search_error" in b]
+    if errors:
+        logger.warning(f"Product search failed at {len(errors)} shop(s): {errors[0]}")
+        return {"businesses": businesses, "partial": partial, "upstream_error": errors[0]}
+    return {"businesses": businesses, "partial": partial}
+
+async def response_synthesizer_node(state: ShoppingAgentState):
     """
     This node synthesizes the final, user-facing response based on
-    the businesses found and product search results.
+    the businesses found and product search results. A partial search is
+    mentioned in the answer, and an answer that cannot be written in time
+    is replaced by the plain list of businesses.
     """
     system_prompt = """You are a helpful local shopping assistant.
 Your goal is to help users find products from local businesses.
@@ -136,16 +436,20 @@ If no businesses were found, apologize and say you couldn't find any matching lo
 
 Here are the top businesses found:
 {businesses}
+{partial_note}"""
+    partial_note = """
+The search was stopped early because it was taking too long, so not every store was checked.
+Mention briefly that the user can ask again for more results.
 """
     
     # 1. Filter for valid results (must have a product link)
     valid_businesses = [b for b in state.get("businesses", []) if b.get("product_url")]
 
     # 2. Sort by business score (ascending) to prioritize smaller businesses.
-    sorted_businesses = sorted(valid_businesses, key=lambda b: b.get("score", float('inf')))
+    sorted_businesses = sorted(valid_businesses, key=_ranking_key)
 
-    # Limit the recommendations to a maximum of 3.
-    top_businesses = sorted_businesses[:3]
+    # Limit the recommendations to a maximum of PRODUCT_SEARCH_TOP_K (3 by default).
+    top_businesses = sorted_businesses[:PRODUCT_SEARCH_TOP_K]
 
     business_strings = []
     for b in top_businesses:
@@ -158,10 +462,52 @@ Here are the top businesses found:
     if not top_businesses:
         business_list_str = "No businesses found."
 
-    final_prompt = system_prompt.format(businesses=business_list_str)
-    
-    response = llm.invoke([SystemMessage(content=final_prompt)] + state["messages"])
-    return {"messages": [response]}
+    partial = bool(state.get("partial")) or (out_of_budget(state) and len(top_businesses) < PRODUCT_SEARCH_TOP_K)
+    final_prompt = system_prompt.format(businesses=business_list_str, partial_note=partial_note if partial else "")
+
+    # The answer may use the reserve kept by the search phases, but always gets a minimum.
+    deadline = state.get("deadline")
+    if deadline is not None:
+        deadline = max(deadline, time.time() + min(SYNTHESIS_MIN_TIMEOUT, SYNTHESIS_TIMEOUT))
+    timeout = call_timeout(deadline, SYNTHESIS_TIMEOUT)
+    try:
+        # The answer is streamed to the client as it is written, so it is never retried or hedged.
+        response = await call_upstream(
+            "openai", lambda: llm.ainvoke([SystemMessage(content=final_prompt)] + state["messages"]),
+            max_attempts=1, hedge=False, timeout=SYNTHESIS_TIMEOUT, deadline=deadline
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Response synthesis timed out after {timeout:.1f}s, answering with the plain list")
+        if not top_businesses:
+            business_list_str = "Îmi pare rău, nu am găsit la timp niciun magazin local potrivit."
+        return {"messages": [AIMessage(content=business_list_str)], "partial": True}
+    return {"messages": [response], "partial": partial}
+
+async def response_cache_lookup_node(state: ShoppingAgentState):
+    """
+    Answers from the response cache when the same intent was already served
+    near the user's location.
+    """
+    if not RESPONSE_CACHE_ENABLED or not state.get("user_location"):
+        return {"response_cached": False}
+    entry = await response_cache.lookup(state)
+    if entry is None:
+        return {"response_cached": False}
+    logger.info(f"Serving '{state.get('search_keywords')}' from the response cache")
+    return {"response_cached": True, "messages": [AIMessage(content=entry["content"])]}
+
+async def response_cache_store_node(state: ShoppingAgentState):
+    """
+    Stores the synthesized answer in the response cache, unless it is partial, an upstream
+    failed during the run or no business was found: those answers only hold until it recovers.
+    """
+    if not RESPONSE_CACHE_ENABLED or not state.get("user_location"):
+        return {}
+    if state.get("partial") or state.get("upstream_error") or not state.get("businesses"):
+        logger.info(f"Not caching the answer for '{state.get('search_keywords')}': incomplete search")
+        return {}
+    await response_cache.store(state, state["messages"][-1].content)
+    return {}
 
 def predefined_response_node(state: ShoppingAgentState):
     """
@@ -173,38 +519,82 @@ def predefined_response_node(state: ShoppingAgentState):
 # --- Conditional Edge Logic ---
 def should_continue(state: ShoppingAgentState) -> str:
     """Determines which path to take based on query classification."""
+    if state.get("partial"):
+        # The budget ran out during the analysis.
+        return "answer_with_partial_results"
     if state.get("is_clothing_query"):
-        return "continue_to_extraction"
+        return "continue_to_search"
     else:
         return "end_with_predefined_response"
 
+def use_cached_response(state: ShoppingAgentState) -> str:
+    """
+    Skips the search when the response cache already had the answer, and the
+    business search when a session follow-up only changed the attributes.
+    """
+    if state.get("response_cached"):
+        return "end_with_cached_response"
+    if can_reuse_businesses(state):
+        logger.info(f"Reusing {len(state['businesses'])} businesses for the refined search '{state.get('search_keywords')}'")
+        return "reuse_businesses"
+    return "continue_to_search"
+
+def route_intent(state: ShoppingAgentState) -> str:
+    """Sends ambiguous queries to the LLM and routes local decisions directly."""
+    if not state.get("intent_decided_locally"):
+        return "analyze_with_llm"
+    return should_continue(state)
+
 # --- Graph Definition ---
 builder = StateGraph(ShoppingAgentState)
 
+# Every node is timed by `metrics.py`.
+
 # Define the nodes
-builder.add_node("initialize_state", initialize_state_node)
-builder.add_node("classify_query", query_classifier_node)
-builder.add_node("extract_keywords", query_extractor_node)
-builder.add_node("find_businesses", business_finder_node)
-builder.add_node("search_for_product", product_search_node)
-builder.add_node("synthesize_response", response_synthesizer_node)
-builder.add_node("predefined_response", predefined_response_node)
+builder.add_node("initialize_state", instrument_node("initialize_state", initialize_state_node))
+builder.add_node("fast_classify", instrument_node("fast_classify", intent_fast_path_node))
+builder.add_node("analyze_query", instrument_node("analyze_query", query_analyzer_node))
+builder.add_node("check_response_cache", instrument_node("check_response_cache", response_cache_lookup_node))
+builder.add_node("find_businesses", instrument_node("find_businesses", business_finder_node))
+builder.add_node("search_for_product", instrument_node("search_for_product", product_search_node))
+builder.add_node("synthesize_response", instrument_node("synthesize_response", response_synthesizer_node))
+builder.add_node("store_response", instrument_node("store_response", response_cache_store_node))
+builder.add_node("predefined_response", instrument_node("predefined_response", predefined_response_node))
 
 # Define the edges
 builder.set_entry_point("initialize_state")
-builder.add_edge("initialize_state", "classify_query")
+builder.add_edge("initialize_state", "fast_classify")
+builder.add_conditional_edges(
+    "fast_classify",
+    route_intent,
+    {
+        "analyze_with_llm": "analyze_query",
+        "continue_to_search": "check_response_cache",
+        "end_with_predefined_response": "predefined_response",
+    },
+)
 builder.add_conditional_edges(
-    "classify_query",
+    "analyze_query",
     should_continue,
     {
-        "continue_to_extraction": "extract_keywords",
+        "continue_to_search": "check_response_cache",
+        "answer_with_partial_results": "synthesize_response",
         "end_with_predefined_response": "predefined_response",
     },
 )
-builder.add_edge("extract_keywords", "find_businesses")
+builder.add_conditional_edges(
+    "check_response_cache",
+    use_cached_response,
+    {
+        "continue_to_search": "find_businesses",
+        "reuse_businesses": "search_for_product",
+        "end_with_cached_response": END,
+    },
+)
 builder.add_edge("find_businesses", "search_for_product")
 builder.add_edge("search_for_product", "synthesize_response")
-builder.add_edge("synthesize_response", END)
+builder.add_edge("synthesize_response", "store_response")
+builder.add_edge("store_response", END)
 builder.add_edge("predefined_response", END)
 
 shopping_graph = builder.compile()
@@ -0,0 +1,170 @@
+import os
+import json
+import zlib
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .text import tokenize_with_originals
+
+logger = logging.getLogger(__name__)
+
+# --- Intent Fast Path Configuration ---
+INTENT_FAST_PATH_ENABLED = os.getenv("INTENT_FAST_PATH_ENABLED", "true").lower() == "true"
+# Queries are decided locally only when the model is at least this confident.
+INTENT_POSITIVE_THRESHOLD = float(os.getenv("INTENT_POSITIVE_THRESHOLD", "0.85"))
+INTENT_NEGATIVE_THRESHOLD = float(os.getenv("INTENT_NEGATIVE_THRESHOLD", "0.15"))
+INTENT_LABELED_QUERIES_PATH = os.getenv(
+    "INTENT_LABELED_QUERIES_PATH", os.path.join(os.path.dirname(__file__), "data", "intent_queries.jsonl")
+)
+
+# --- Lexicon ---
+# Normalized (no diacritics) prefixes of Romanian and English clothing words, e.g. "jachet" matches "jachetă" and "jachete".
+CLOTHING_STEMS = (
+    "jachet", "geac", "geci", "palton", "haina", "haine", "rochi", "fust", "bluz", "camas", "tricou", "pantalon",
+    "blugi", "pulover", "hanorac", "costum", "sacou", "pardesi", "trench", "colant", "salopet", "lenjeri",
+    "sosete", "ciorap", "pijam", "fular", "esarf", "caciul", "palari", "sapca", "manus", "pantof", "adidas",
+    "ghete", "cizm", "sandal", "papuc", "incaltamint", "imbracamint", "maiou", "cardigan", "bikini",
+    "jacket", "blouse", "shirt", "t-shirt", "tshirt", "trouser", "jeans", "sweater", "jumper", "hoodie", "blazer",
+    "legging", "socks", "underwear", "scarf", "sneaker", "boots", "sandals", "clothes", "clothing", "swimsuit",
+)
+# Short words that also start unrelated ones ("suitcase", "vestea", "coatrack"): matched whole, with these endings only.
+CLOTHING_WORDS = {
+    stem + ending
+    for stem, endings in {
+        "suit": ("", "s"), "coat": ("", "s"), "dress": ("", "es"), "skirt": ("", "s"), "shoe": ("", "s"),
+        "glove": ("", "s"), "shorts": ("",), "vest": ("", "s", "a", "e", "ei", "ele", "elor"),
+    }.items()
+    for ending in endings
+}
+# Words that carry no product information (normalized).
+FILLER_WORDS = {
+    "vreau", "vrea", "as", "am", "ai", "sa", "sa-mi", "sa-ti", "imi", "mi", "iau", "cumpar", "cumpara", "caut",
+    "cauta", "gasesc", "gasi", "unde", "pot", "o", "un", "una", "niste", "nevoie", "trebuie", "te", "rog", "si",
+    "ceva", "i", "m", "d", "want", "wanna", "to", "buy", "a", "an", "the", "some", "looking", "need", "where",
+    "can", "find", "would", "like", "please", "me", "my", "get", "is",
+}
+# Words that attach the following word to an attribute ("de piele", "for winter").
+JOINER_WORDS = {"de", "din", "cu", "fara", "pentru", "la", "for", "with", "in", "of"}
+
+def is_clothing_word(normalized_word: str) -> bool:
+    """True if a normalized word is a clothing item from the lexicon."""
+    return normalized_word in CLOTHING_WORDS or any(normalized_word.startswith(stem) for stem in CLOTHING_STEMS)
+
+def query_words(query: str) -> List[str]:
+    """The normalized words of a query, as read by both the classifier and `extract_locally`."""
+    return [word for word, _ in tokenize_with_originals(query)]
+
+def extract_locally(query: str) -> Optional[Dict]:
+    """
+    Extracts the main product, its attributes and the search keywords without an LLM.
+    Returns None when no clothing word is found.
+    """
+    tokens = tokenize_with_originals(query)
+    normalized = [word for word, _ in tokens]
+    words = [original.lower() for _, original in tokens]
+    product_index = next((i for i, w in enumerate(normalized) if is_clothing_word(w)), None)
+    if product_index is None:
+        return None
+
+    # Adjectives before the product (mostly English) and attributes after it (mostly Romanian).
+    before = [words[i] for i in range(product_index)
+              if normalized[i] not in FILLER_WORDS and normalized[i] not in JOINER_WORDS]
+    attributes, pending_joiner = [], None
+    for word, norm in zip(words[product_index + 1:], normalized[product_index + 1:]):
+        if norm in JOINER_WORDS:
+            pending_joiner = word
+        elif norm not in FILLER_WORDS:
+            attributes.append(f"{pending_joiner} {word}" if pending_joiner else word)
+            pending_joiner = None
+
+    main_product = words[product_index]
+    return {
+        "main_product": main_product,
+        "attributes": before + attributes,
+        "search_keywords": " ".join(before + [main_product] + attributes),
+    }
+
+# --- Linear Model ---
+class IntentClassifier:
+    """
+    A logistic regression over hashed character n-grams and words, with the
+    lexicon match as an extra feature. Small enough to train at startup on CPU.
+    """
+    def __init__(self, n_features: int = 2 ** 14, epochs: int = 500, learning_rate: float = 2.0, l2: float = 1e-4):
+        self.n_features = n_features
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.weights = np.zeros(n_features, dtype=np.float32)
+        self.bias = 0.0
+
+    def _features(self, query: str) -> np.ndarray:
+        words = query_words(query)
+        grams = [f"w:{w}" for w in words]
+        for word in words:
+            padded = f"_{word}_"
+            for n in (3, 4, 5):
+                grams.extend(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+
+        vector = np.zeros(self.n_features, dtype=np.float32)
+        for gram in grams:
+            # Index 0 is reserved for the lexicon feature.
+            vector[1 + zlib.crc32(gram.encode("utf-8")) % (self.n_features - 1)] += 1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        vector[0] = 1.0 if any(is_clothing_word(w) for w in words) else 0.0
+        return vector
+
+    def fit(self, queries: Sequence[str], labels: Sequence[bool]) -> "IntentClassifier":
+        """Trains the model with full-batch gradient descent."""
+        x = np.stack([self._features(q) for q in queries])
+        y = np.asarray(labels, dtype=np.float32)
+        self.weights = np.zeros(self.n_features, dtype=np.float32)
+        self.bias = 0.0
+        for _ in range(self.epochs):
+            error = self._sigmoid(x @ self.weights + self.bias) - y
+            self.weights -= self.learning_rate * (x.T @ error / len(y) + self.l2 * self.weights)
+            self.bias -= self.learning_rate * float(error.mean())
+        return self
+
+    @staticmethod
+    def _sigmoid(z: np.ndarray) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-z))
+
+    def predict_proba(self, query: str) -> float:
+        """Returns the probability that the query is about buying clothing."""
+        return float(self._sigmoid(self._features(query) @ self.weights + self.bias))
+
+    def classify(self, query: str) -> Tuple[Optional[bool], float]:
+        """
+        Returns (is_clothing_query, probability). The decision is None when the
+        query is ambiguous and should be classified by the LLM.
+        A positive also needs a lexicon match, so a local extraction is always possible.
+        """
+        probability = self.predict_proba(query)
+        has_clothing_word = any(is_clothing_word(w) for w in query_words(query))
+        if has_clothing_word and probability >= INTENT_POSITIVE_THRESHOLD:
+            return True, probability
+        if not has_clothing_word and probability <= INTENT_NEGATIVE_THRESHOLD:
+            return False, probability
+        return None, probability
+
+def load_labeled_queries(path: str = INTENT_LABELED_QUERIES_PATH) -> List[Tuple[str, bool]]:
+    """Reads a JSONL file of {"query": ..., "is_clothing_query": ...} records."""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [(r["query"], bool(r["is_clothing_query"])) for r in records]
+
+_classifier: Optional[IntentClassifier] = None
+
+def get_intent_classifier() -> IntentClassifier:
+    """Returns the process-wide classifier, training it on the labeled queries on first use."""
+    global _classifier
+    if _classifier is None:
+        labeled = load_labeled_queries()
+        _classifier = IntentClassifier().fit([q for q, _ in labeled], [l for _, l in labeled])
+        logger.info(f"Trained the local intent classifier on {len(labeled)} labeled queries")
+    return _classifier
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import uuid
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from .cache import cache_stats
+
+logger = logging.getLogger(__name__)
+
+# --- Metrics Configuration ---
+# Metrics are kept per process and served in the Prometheus text format by GET /metrics.
+# Latency buckets, in seconds.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# USD per million tokens, used to estimate the LLM cost (gpt-4o list prices by default).
+LLM_INPUT_COST_PER_1M = float(os.getenv("LLM_INPUT_COST_PER_1M", "2.5"))
+LLM_OUTPUT_COST_PER_1M = float(os.getenv("LLM_OUTPUT_COST_PER_1M", "10"))
+# When enabled, every request logs one JSON line with its nodes, upstream calls and tokens.
+REQUEST_TRACE_LOGS = os.getenv("REQUEST_TRACE_LOGS", "false").lower() == "true"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Counter:
+    """A monotonically increasing value per label set."""
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    """Observations counted in cumulative buckets, with their count and sum, per label set."""
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.values: Dict[Labels, dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self.values.setdefault(key, {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["count"] += 1
+            entry["sum"] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in self.values.items():
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', str(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {entry['count']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {entry['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {entry['sum']}")
+        return lines
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{_escape(str(v))}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _gauge(name: str, help_text: str, samples: List[Tuple[Dict[str, str], float]]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+    return lines
+
+NODE_DURATION = Histogram("shopping_node_duration_seconds", "Wall time of each graph node.")
+NODE_ERRORS = Counter("shopping_node_errors_total", "Graph node runs that raised an error.")
+UPSTREAM_DURATION = Histogram("upstream_call_duration_seconds", "Wall time of each upstream call, retries and hedges included.")
+UPSTREAM_CALLS = Counter("upstream_calls_total", "Upstream calls by outcome.")
+LLM_CALLS = Counter("llm_calls_total", "LLM calls per graph node.")
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens per graph node and kind (prompt or completion).")
+LLM_COST = Counter("llm_cost_usd_total", "Estimated LLM cost in USD per graph node.")
+REQUEST_DURATION = Histogram("shopping_request_duration_seconds", "Wall time of a whole shopping request, per channel.")
+REQUESTS = Counter("shopping_requests_total", "Shopping requests per channel and outcome.")
+
+# --- Request Traces ---
+class RequestTrace:
+    """The spans of one request, logged as a single JSON line when it ends."""
+    def __init__(self, channel: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.channel = channel
+        self.started = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, kind: str, name: str, seconds: float, **fields: Any) -> None:
+        self.spans.append({
+            "kind": kind, "name": name,
+            "start": round(time.monotonic() - seconds - self.started, 3), "seconds": round(seconds, 3), **fields
+        })
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+# The graph node running in the current context, used to attribute upstream calls and tokens.
+_current_node: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("graph_node", default=None)
+
+@contextmanager
+def track_request(channel: str):
+    """
+    Measures a whole shopping request and, with REQUEST_TRACE_LOGS, collects and logs its trace.
+    Tasks started inside (the graph's nodes) share the trace.
+    """
+    trace = RequestTrace(channel) if REQUEST_TRACE_LOGS else None
+    token = _current_trace.set(trace)
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.monotonic() - started
+        _current_trace.reset(token)
+        REQUEST_DURATION.observe(elapsed, channel=channel)
+        REQUESTS.inc(channel=channel, outcome=outcome)
+        if trace is not None:
+            logger.info("request_trace " + json.dumps(
+                {"trace_id": trace.id, "channel": channel, "outcome": outcome, "seconds": round(elapsed, 3), "spans": trace.spans},
+                ensure_ascii=False
+            ))
+
+def instrument_node(name: str, node: Callable) -> Callable:
+    """Wraps a graph node (sync or async) to record its wall time and errors."""
+    def record(started: float, failed: bool):
+        elapsed = time.monotonic() - started
+        NODE_DURATION.observe(elapsed, node=name)
+        if failed:
+            NODE_ERRORS.inc(node=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add("node", name, elapsed, error=failed)
+
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def async_wrapper(*args, **kwargs):
+            token = _current_node.set(name)
+            started, failed = time.monotonic(), True
+            try:
+                result = await node(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record(started, failed)
+                _current_node.reset(token)
+        return async_wrapper
+
+    @functools.wraps(node)
+    def wrapper(*args, **kwargs):
+        token = _current_node.set(name)
+        started, failed = time.monotonic(), True
+        try:
+            result = node(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record(started, failed)
+            _current_node.reset(token)
+    return wrapper
+
+def record_upstream_call(upstream: str, seconds: float, outcome: str) -> None:
+    """Records one upstream call, attributed to the graph node that made it."""
+    node = _current_node.get() or "none"
+    UPSTREAM_DURATION.observe(seconds, upstream=upstream, node=node)
+    UPSTREAM_CALLS.inc(upstream=upstream, outcome=outcome)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add("upstream", upstream, seconds, node=node, outcome=outcome)
+
+def record_llm_usage(node: str, prompt_tokens: int, completion_tokens: int) -> None:
+    cost = (prompt_tokens * LLM_INPUT_COST_PER_1M + completion_tokens * LLM_OUTPUT_COST_PER_1M) / 1_000_000
+    LLM_CALLS.inc(node=node)
+    LLM_TOKENS.inc(prompt_tokens, node=node, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, node=node, kind="completion")
+    LLM_COST.inc(cost, node=node)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add("llm", node, 0.0, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost_usd=round(cost, 6))
+
+class LLMUsageCallback(AsyncCallbackHandler):
+    """Counts the calls and tokens of the chat models it is attached to, per graph node."""
+    def __init__(self):
+        self._nodes: Dict[UUID, str] = {}
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        self._nodes[run_id] = (metadata or {}).get("langgraph_node") or _current_node.get() or "none"
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        node = self._nodes.pop(run_id, None) or _current_node.get() or "none"
+        prompt_tokens = completion_tokens = 0
+        message = getattr(response.generations[0][0], "message", None) if response.generations and response.generations[0] else None
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            prompt_tokens, completion_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        elif response.llm_output and response.llm_output.get("token_usage"):
+            token_usage = response.llm_output["token_usage"]
+            prompt_tokens, completion_tokens = token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+        record_llm_usage(node, prompt_tokens, completion_tokens)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._nodes.pop(run_id, None)
+
+llm_usage_callback = LLMUsageCallback()
+
+def render_metrics() -> str:
+    """All metrics of this process in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in (REQUESTS, REQUEST_DURATION, NODE_DURATION, NODE_ERRORS, UPSTREAM_CALLS, UPSTREAM_DURATION,
+                   LLM_CALLS, LLM_TOKENS, LLM_COST):
+        lines.extend(metric.render())
+
+    caches = cache_stats()
+    lines.extend(_gauge("cache_hits", "Cache hits since startup.", [({"cache": n}, s["hits"]) for n, s in caches.items()]))
+    lines.extend(_gauge("cache_misses", "Cache misses since startup.", [({"cache": n}, s["misses"]) for n, s in caches.items()]))
+    lines.extend(_gauge("cache_hit_rate", "Share of cache lookups that were hits.", [({"cache": n}, s["hit_rate"]) for n, s in caches.items()]))
+
+    # Imported here: `resilience.py` reports its calls to this module.
+    from .resilience import upstream_stats
+    upstreams = upstream_stats()
+    lines.extend(_gauge("upstream_circuit_open", "1 while the upstream's circuit breaker is not closed.",
+                        [({"upstream": u}, 0 if s["circuit"] == "closed" else 1) for u, s in upstreams.items()]))
+    lines.extend(_gauge("upstream_retries", "Retries since startup.", [({"upstream": u}, s["retries"]) for u, s in upstreams.items()]))
+    lines.extend(_gauge("upstream_hedges", "Hedged attempts since startup.", [({"upstream": u}, s["hedges"]) for u, s in upstreams.items()]))
+    lines.extend(_gauge("upstream_rejected", "Calls rejected by an open circuit since startup.",
+                        [({"upstream": u}, s["rejected"]) for u, s in upstreams.items()]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,387 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from tavily.errors import BadRequestError, ForbiddenError, InvalidAPIKeyError, MissingAPIKeyError
+
+from .budget import remaining
+from .concurrency import UPSTREAM_CONCURRENCY_LIMITS, upstream_limit
+from .metrics import record_upstream_call
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# --- Resilience Configuration ---
+# Every call to an upstream (Google Maps, Tavily, OpenAI, Twilio, ANAF) goes through `call_upstream`,
+# which adds a circuit breaker, jittered retries limited by a retry budget and, for idempotent
+# reads, a hedged second attempt once the first one is slower than the upstream's usual p95.
+UPSTREAMS = ("gmaps", "tavily", "openai", "twilio", "anaf")
+# Attempts per call, the first one included. Sending a WhatsApp message is not idempotent,
+# so Twilio calls are never repeated here (the job queue retries them instead).
+UPSTREAM_MAX_ATTEMPTS: Dict[str, int] = {
+    "gmaps": int(os.getenv("GMAPS_MAX_ATTEMPTS", "3")),
+    "tavily": int(os.getenv("TAVILY_MAX_ATTEMPTS", "3")),
+    "openai": int(os.getenv("OPENAI_MAX_ATTEMPTS", "2")),
+    "twilio": 1,
+    "anaf": int(os.getenv("ANAF_MAX_ATTEMPTS", "3")),
+}
+# Retries wait base * 2^(retry - 1) seconds, capped and jittered.
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.2"))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "2"))
+# Retry budget: every call earns this fraction of a retry, so that retries stay a bounded share
+# of the traffic when an upstream degrades, plus a small reserve for quiet periods.
+UPSTREAM_RETRY_BUDGET_RATIO = float(os.getenv("UPSTREAM_RETRY_BUDGET_RATIO", "0.2"))
+UPSTREAM_RETRY_BUDGET_RESERVE = float(os.getenv("UPSTREAM_RETRY_BUDGET_RESERVE", "10"))
+# A breaker opens after this many consecutive failures and lets a probe call through after the cooldown.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RECOVERY_SECONDS = float(os.getenv("CIRCUIT_RECOVERY_SECONDS", "30"))
+# Upstreams whose calls are hedged (comma-separated). Hedging doubles the slowest calls,
+# so it is kept to the cheap, idempotent searches by default. Google Maps is left out: its
+# client is blocking and runs on the I/O thread pool, where cancelling the losing attempt
+# does not free its thread, so every hedge would hold a second worker while gmaps is slow.
+UPSTREAM_HEDGING = {u.strip() for u in os.getenv("UPSTREAM_HEDGING", "tavily").split(",") if u.strip()}
+# The hedge is sent once the first attempt is slower than the p95 of the last successful calls
+# (never sooner than HEDGE_MIN_DELAY), and only when that many calls have been measured.
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 200
+# Status codes that say the upstream is fine but the request is not; those are never retried.
+_RETRYABLE_CLIENT_STATUSES = {408, 429}
+# Google Maps reports its errors with a status name.
+_RETRYABLE_STATUS_NAMES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+# The Tavily client raises its own types, without a status code, for the 4xx answers:
+# a bad key or a refused request is a configuration problem, not a failing upstream.
+# Its UsageLimitExceededError stays retryable: it is raised for every 429, rate limits included.
+_NON_RETRYABLE_ERRORS = (
+    ValueError, TypeError, KeyError,
+    BadRequestError, ForbiddenError, InvalidAPIKeyError, MissingAPIKeyError,
+)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__(f"The '{upstream}' upstream is failing, calls are suspended for {retry_in:.0f}s")
+        self.upstream = upstream
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    False for errors that another attempt cannot fix: configuration errors (a missing API key)
+    and client errors reported by the upstream (4xx other than timeouts and rate limits).
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    if isinstance(error, _NON_RETRYABLE_ERRORS + (CircuitOpenError,)):
+        return False
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int):
+        return not (400 <= status < 500) or status in _RETRYABLE_CLIENT_STATUSES
+    if isinstance(status, str):
+        return status in _RETRYABLE_STATUS_NAMES
+    return True
+
+class CircuitBreaker:
+    """
+    Fails calls fast once an upstream keeps failing. Closed: calls go through. Open: calls are
+    rejected for CIRCUIT_RECOVERY_SECONDS. Half-open: a single probe decides whether to close again.
+    """
+    def __init__(self, upstream: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_seconds: float = CIRCUIT_RECOVERY_SECONDS):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError if the call must not be made."""
+        with self._lock:
+            if self.state == "open":
+                retry_in = self.opened_at + self.recovery_seconds - time.monotonic()
+                if retry_in > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.upstream, retry_in)
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.upstream, 0)
+                self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Upstream '{self.upstream}' recovered, closing its circuit")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    logger.warning(
+                        f"Opening the circuit of '{self.upstream}' for {self.recovery_seconds}s "
+                        f"after {self.consecutive_failures} consecutive failures"
+                    )
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Lets another probe through when the probe ended without an outcome (e.g. it was cancelled)."""
+        with self._lock:
+            self._probing = False
+
+class UpstreamHealth:
+    """The breaker, retry budget and latency window of one upstream."""
+    def __init__(self, upstream: str):
+        self.upstream = upstream
+        self.breaker = CircuitBreaker(upstream)
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self.retry_tokens = UPSTREAM_RETRY_BUDGET_RESERVE
+        self.calls = self.failures = self.retries = self.hedges = self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def start_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self.retry_tokens = min(self.retry_tokens + UPSTREAM_RETRY_BUDGET_RATIO, UPSTREAM_RETRY_BUDGET_RESERVE)
+
+    def take_retry(self) -> bool:
+        """Spends one retry from the budget; False when it is exhausted."""
+        with self._lock:
+            if self.retry_tokens < 1:
+                return False
+            self.retry_tokens -= 1
+            self.retries += 1
+            return True
+
+    def record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        """The p95 latency of the recent successful calls, or None without enough samples."""
+        with self._lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "times_opened": self.breaker.times_opened,
+            "rejected": self.breaker.rejected,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "retry_budget": round(self.retry_tokens, 2),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+        }
+
+_health: Dict[str, UpstreamHealth] = {upstream: UpstreamHealth(upstream) for upstream in UPSTREAMS}
+
+def upstream_health(upstream: str) -> UpstreamHealth:
+    return _health[upstream]
+
+def upstream_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns the breaker state and counters of every upstream."""
+    return {upstream: health.stats() for upstream, health in _health.items()}
+
+def _backoff(retry: int) -> float:
+    delay = min(UPSTREAM_RETRY_BASE_DELAY * 2 ** (retry - 1), UPSTREAM_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+async def _attempt(upstream: str, make_call: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+    """
+    A single call, bounded by the upstream's concurrency limit if it has one.
+    Raises asyncio.TimeoutError when it takes longer than `timeout` seconds.
+    """
+    async def run() -> T:
+        if upstream in UPSTREAM_CONCURRENCY_LIMITS:
+            async with upstream_limit(upstream):
+                return await make_call()
+        return await make_call()
+
+    if timeout is None:
+        return await run()
+    return await asyncio.wait_for(run(), timeout=timeout)
+
+async def _hedged_attempt(health: UpstreamHealth, make_call: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+    """
+    Runs an attempt and, if it is still running after the p95 delay, a second one.
+    The first to succeed wins and the other is cancelled. Both end by `timeout`.
+    """
+    p95 = health.p95()
+    first = asyncio.ensure_future(_attempt(health.upstream, make_call, timeout))
+    if p95 is None:
+        return await first
+
+    attempts = [first]
+    started = time.monotonic()
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=max(p95, HEDGE_MIN_DELAY))
+        left = None if timeout is None else timeout - (time.monotonic() - started)
+        if not done and (left is None or left > 0):
+            health.hedges += 1
+            attempts.append(asyncio.ensure_future(_attempt(health.upstream, make_call, left)))
+        error: Optional[BaseException] = None
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    if attempt is not first:
+                        health.hedge_wins += 1
+                    return attempt.result()
+                error = attempt.exception()
+        raise error
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+async def call_upstream(
+    upstream: str,
+    make_call: Callable[[], Awaitable[T]],
+    max_attempts: Optional[int] = None,
+    hedge: Optional[bool] = None,
+    timeout: Optional[float] = None,
+    deadline: Optional[float] = None,
+) -> T:
+    """
+    Calls an upstream through its circuit breaker, retrying retryable errors with jittered
+    backoff while the retry budget allows. `make_call` creates a new awaitable per attempt.
+    `max_attempts` and `hedge` override the upstream's configuration, e.g. for a streamed
+    answer that must not be repeated. Two limits bound the whole call, retries included:
+    `timeout` is the upstream's own cap in seconds, and an attempt cut off by it counts as a
+    failure of the upstream, so that a hung upstream opens its breaker; `deadline` is the
+    wall-clock deadline of the request (see `budget.py`), and running out of it says nothing
+    about the upstream, so it is never counted against the breaker. Raises CircuitOpenError
+    when the breaker is open, asyncio.TimeoutError when either limit ran out, otherwise the
+    last error.
+    """
+    health = _health[upstream]
+    attempts = max_attempts if max_attempts is not None else UPSTREAM_MAX_ATTEMPTS[upstream]
+    hedged = hedge if hedge is not None else upstream in UPSTREAM_HEDGING
+    health.start_call()
+
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        result = await _call_with_retries(health, make_call, attempts, hedged, timeout, deadline)
+        outcome = "ok"
+        return result
+    except CircuitOpenError:
+        outcome = "circuit_open"
+        raise
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        record_upstream_call(upstream, time.monotonic() - started, outcome)
+
+async def _call_with_retries(health: UpstreamHealth, make_call: Callable[[], Awaitable[T]], attempts: int, hedged: bool,
+                             timeout: Optional[float] = None, deadline: Optional[float] = None) -> T:
+    upstream = health.upstream
+    cap_end = float('inf') if timeout is None else time.monotonic() + timeout
+    attempt = 1
+    while True:
+        budget_left = remaining(deadline)
+        if budget_left <= 0:
+            # The request is out of time; the upstream is not called, nor blamed.
+            raise asyncio.TimeoutError()
+        health.breaker.before_call()
+        started = time.monotonic()
+        cap_left = max(cap_end - started, 0.0)
+        limit = min(cap_left, budget_left)
+        # When the request's deadline comes first, a timeout is the request's fault.
+        budget_bound = budget_left < cap_left
+        try:
+            result = await (_hedged_attempt(health, make_call, _seconds(limit)) if hedged
+                            else _attempt(upstream, make_call, _seconds(limit)))
+        except asyncio.CancelledError:
+            health.breaker.release_probe()
+            raise
+        except Exception as e:
+            if not is_retryable(e) or (isinstance(e, asyncio.TimeoutError) and budget_bound):
+                # The upstream answered, or was not given its full time; only this request failed.
+                health.breaker.release_probe()
+                raise
+            health.failures += 1
+            health.breaker.record_failure()
+            delay = _backoff(attempt)
+            out_of_time = time.monotonic() + delay >= cap_end or delay >= remaining(deadline)
+            if attempt >= attempts or out_of_time or not health.take_retry():
+                raise
+            logger.warning(f"Call to '{upstream}' failed (attempt {attempt}/{attempts}), retrying: {e!r}")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        health.record_latency(time.monotonic() - started)
+        health.breaker.record_success()
+        return result
+
+def _seconds(limit: float) -> Optional[float]:
+    """An attempt's timeout for asyncio, None when unbounded."""
+    return None if limit == float('inf') else limit
+
+def call_upstream_blocking(upstream: str, func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    The synchronous variant of `call_upstream` for code that runs outside the event loop:
+    the same breaker, retries and budget, without hedging.
+    """
+    health = _health[upstream]
+    attempts = UPSTREAM_MAX_ATTEMPTS[upstream]
+    health.start_call()
+
+    call_started = time.monotonic()
+    outcome = "error"
+    attempt = 1
+    try:
+        while True:
+            health.breaker.before_call()
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    health.breaker.release_probe()
+                    raise
+                health.failures += 1
+                health.breaker.record_failure()
+                if attempt >= attempts or not health.take_retry():
+                    raise
+                logger.warning(f"Call to '{upstream}' failed (attempt {attempt}/{attempts}), retrying: {e}")
+                time.sleep(_backoff(attempt))
+                attempt += 1
+                continue
+            health.record_latency(time.monotonic() - started)
+            health.breaker.record_success()
+            outcome = "ok"
+            return result
+    except CircuitOpenError:
+        outcome = "circuit_open"
+        raise
+    finally:
+        record_upstream_call(upstream, time.monotonic() - call_started, outcome)
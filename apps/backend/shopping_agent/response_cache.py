@@ -0,0 +1,159 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .cache import CACHES
+from .geo import encode_geohash
+from .text import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# --- Response Cache Configuration ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(6 * 3600)))  # 6 hours
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# Answers are shared by every user in the same geohash tile (precision 5 is roughly 4.9km x 4.9km).
+RESPONSE_CACHE_TILE_PRECISION = int(os.getenv("RESPONSE_CACHE_TILE_PRECISION", "5"))
+# Optional embedding-similarity matching for intents that are worded differently.
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.92"))
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+
+def intent_text(state: Dict[str, Any]) -> str:
+    """A normalized description of the extracted intent, independent of attribute order."""
+    main_product = normalize_text(state.get("main_product", ""))
+    attributes = sorted(normalize_text(a) for a in state.get("attributes") or [])
+    if not main_product and not attributes:
+        return normalize_text(state.get("search_keywords", ""))
+    return " ".join([main_product] + attributes)
+
+class ResponseCache:
+    """
+    An in-memory, size-bounded cache of final answers keyed by the normalized
+    intent and the location tile, with optional embedding-similarity lookups.
+    """
+    def __init__(self, name: str = "response", ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 semantic: bool = RESPONSE_CACHE_SEMANTIC, similarity_threshold: float = RESPONSE_CACHE_SIMILARITY_THRESHOLD):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic = semantic
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._pending_embeddings: Dict[str, np.ndarray] = {}
+        CACHES[name] = self
+
+    def _key(self, tile: str, text: str) -> str:
+        return f"{tile}|{text}"
+
+    def _tile(self, state: Dict[str, Any]) -> str:
+        location = state["user_location"]
+        return encode_geohash(location["lat"], location["lng"], RESPONSE_CACHE_TILE_PRECISION)
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        try:
+            if self._embeddings is None:
+                from langchain_openai import OpenAIEmbeddings
+                self._embeddings = OpenAIEmbeddings(model=RESPONSE_CACHE_EMBEDDING_MODEL)
+            vector = np.asarray(await self._embeddings.aembed_query(text), dtype=np.float32)
+            return vector / (np.linalg.norm(vector) or 1.0)
+        except Exception as e:
+            logger.warning(f"Could not embed '{text}' for the response cache: {e}")
+            return None
+
+    def _evict(self) -> None:
+        now = time.time()
+        while self._entries:
+            oldest_key, oldest = next(iter(self._entries.items()))
+            if now - oldest["stored_at"] < self.ttl and len(self._entries) <= self.max_entries:
+                break
+            self._entries.pop(oldest_key)
+
+    async def lookup(self, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached entry for the state's intent and location, or None.
+        The entry holds the answer `content` and the normalized intent `text` it was stored for.
+        """
+        tile, text = self._tile(state), intent_text(state)
+        key = self._key(tile, text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry["stored_at"] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.semantic:
+            vector = await self._embed(text)
+            if vector is not None:
+                match = self._nearest_in_tile(tile, vector)
+                if match is not None:
+                    self.semantic_hits += 1
+                    return match
+                # Kept until the answer is stored, so the query is embedded only once.
+                with self._lock:
+                    self._pending_embeddings[key] = vector
+                    if len(self._pending_embeddings) > self.max_entries:
+                        self._pending_embeddings.pop(next(iter(self._pending_embeddings)))
+
+        self.misses += 1
+        return None
+
+    def _nearest_in_tile(self, tile: str, vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            candidates: List[Dict[str, Any]] = [
+                e for e in self._entries.values()
+                if e["tile"] == tile and e.get("embedding") is not None and now - e["stored_at"] < self.ttl
+            ]
+        if not candidates:
+            return None
+        similarities = np.stack([e["embedding"] for e in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            logger.info(f"Response cache semantic match '{candidates[best]['text']}' (similarity {similarities[best]:.3f})")
+            return candidates[best]
+        return None
+
+    async def store(self, state: Dict[str, Any], content: str) -> None:
+        """Stores the final answer for the state's intent and location."""
+        tile, text = self._tile(state), intent_text(state)
+        key = self._key(tile, text)
+        with self._lock:
+            embedding = self._pending_embeddings.pop(key, None)
+        if self.semantic and embedding is None:
+            embedding = await self._embed(text)
+        with self._lock:
+            self._entries[key] = {
+                "content": content,
+                "tile": tile,
+                "text": text,
+                "embedding": embedding,
+                "stored_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the hit/miss counters of this cache."""
+        hits = self.hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+response_cache = ResponseCache()
@@ -0,0 +1,64 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+import aiosqlite
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from .graph import builder
+
+logger = logging.getLogger(__name__)
+
+# --- Session Configuration ---
+# The graph state of every session (a WhatsApp sender, a web session id) is checkpointed here,
+# so follow-up queries can refine the previous search instead of starting over.
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./sessions.db")
+# A session idle for longer than this many seconds starts over.
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(3600)))
+
+_session_conn: Optional[aiosqlite.Connection] = None
+_session_saver: Optional[AsyncSqliteSaver] = None
+_session_graph = None
+_session_lock = asyncio.Lock()
+
+async def get_session_graph():
+    """Returns the shopping graph compiled with the SQLite checkpointer. Runs need a `thread_id`."""
+    global _session_conn, _session_saver, _session_graph
+    async with _session_lock:
+        if _session_graph is None:
+            _session_conn = await aiosqlite.connect(SESSION_DB_PATH)
+            # Several processes (web app, WhatsApp workers) may share the file.
+            await _session_conn.execute("PRAGMA journal_mode=WAL")
+            _session_saver = AsyncSqliteSaver(_session_conn)
+            await _session_saver.setup()
+            _session_graph = builder.compile(checkpointer=_session_saver)
+        return _session_graph
+
+async def close_session_store():
+    """Closes the checkpointer's connection."""
+    global _session_conn, _session_saver, _session_graph
+    async with _session_lock:
+        if _session_conn is not None:
+            await _session_conn.close()
+        _session_conn = _session_saver = _session_graph = None
+
+def session_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+async def delete_session(thread_id: str) -> None:
+    """Forgets everything checkpointed for the session."""
+    await get_session_graph()
+    await _session_saver.adelete_thread(thread_id)
+
+async def expire_idle_session(thread_id: str) -> None:
+    """Starts the session over if it has been idle for longer than SESSION_TTL."""
+    graph = await get_session_graph()
+    snapshot = await graph.aget_state(session_config(thread_id))
+    if not snapshot.created_at:
+        return
+    idle = (datetime.now(timezone.utc) - datetime.fromisoformat(snapshot.created_at)).total_seconds()
+    if idle > SESSION_TTL:
+        logger.info(f"Session '{thread_id}' was idle for {idle:.0f}s, starting over")
+        await delete_session(thread_id)
@@ -0,0 +1,31 @@
+import re
+import unicodedata
+from typing import List, Tuple
+
+WORD_PATTERN = r"[a-z0-9]+(?:-[a-z0-9]+)*"
+
+def normalize_text(text: str) -> str:
+    """Lowercases, strips diacritics and collapses whitespace (e.g. "Jachetă  NEAGRĂ" -> "jacheta neagra")."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    without_marks = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(without_marks.lower().split())
+
+def tokenize(text: str) -> List[str]:
+    """Splits a normalized text into words, dropping punctuation."""
+    return re.findall(WORD_PATTERN, text)
+
+def tokenize_with_originals(text: str) -> List[Tuple[str, str]]:
+    """
+    The words of `tokenize(normalize_text(text))`, each with the original text it was read from
+    (e.g. "O Jachetă!" -> [("o", "O"), ("jacheta", "Jachetă")]).
+    """
+    normalized, origins = [], []
+    for i, char in enumerate(text or ""):
+        for c in unicodedata.normalize("NFKD", char):
+            if not unicodedata.combining(c):
+                for lowered in c.lower():
+                    normalized.append(lowered)
+                    origins.append(i)
+    normalized = "".join(normalized)
+    return [(m.group(), text[origins[m.start()]:origins[m.end() - 1] + 1])
+            for m in re.finditer(WORD_PATTERN, normalized)]
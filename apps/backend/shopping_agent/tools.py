@@ -1,10 +1,20 @@
 import os
+import asyncio
 import logging
+import math
 import re
 from typing import List, Dict, Any, TypedDict, Optional
 
 import googlemaps
-from tavily import TavilyClient
+from tavily import AsyncTavilyClient
+
+from ..clients import get_clients
+from .cache import TTLCache, create_cache_backend
+from .concurrency import run_blocking
+from .resilience import call_upstream, CircuitOpenError
+from .catalog import get_business_catalog
+from .budget import search_deadline
+from .geo import encode_geohash, neighbor_tiles, tile_center, tile_diagonal_m, distance_m
 
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO)
@@ -22,50 +32,189 @@ class Business(TypedDict):
     product_url: Optional[str]
     score: int
     attribute_match_score: int
+    location: Optional[Dict[str, float]]
+
+# --- Enrichment Configuration ---
+# How many places are enriched (details + score) at the same time.
+ENRICHMENT_MAX_WORKERS = int(os.getenv("ENRICHMENT_MAX_WORKERS", "10"))
+# Timeout (in seconds) for each individual details or scoring call.
+ENRICHMENT_CALL_TIMEOUT = float(os.getenv("ENRICHMENT_CALL_TIMEOUT", "10"))
+
+# --- Place Enrichment Cache ---
+# Websites and popularity scores almost never change, so they are cached per place_id.
+PLACE_WEBSITE_TTL = float(os.getenv("PLACE_WEBSITE_TTL", str(30 * 24 * 3600)))  # 30 days
+PLACE_SCORE_TTL = float(os.getenv("PLACE_SCORE_TTL", str(7 * 24 * 3600)))  # 7 days
+website_cache = TTLCache("place_website", create_cache_backend("place_websites"), ttl=PLACE_WEBSITE_TTL)
+score_cache = TTLCache("place_score", create_cache_backend("place_scores"), ttl=PLACE_SCORE_TTL)
+
+# --- Nearby Search Cache ---
+# Nearby searches are cached per geohash tile and (radius, keyword). A search is run from
+# the tile's center with the radius enlarged by one tile diagonal, so it also covers requests
+# made anywhere in that tile or close to it in a neighboring one; results are then filtered
+# by their exact distance to the user.
+NEARBY_TILE_PRECISION = int(os.getenv("NEARBY_TILE_PRECISION", "6"))
+NEARBY_SEARCH_TTL = float(os.getenv("NEARBY_SEARCH_TTL", str(24 * 3600)))  # 1 day
+MAX_PLACES_RADIUS = 50000  # The largest radius accepted by the Places API, in meters.
+nearby_cache = TTLCache("nearby_search", create_cache_backend("nearby_searches"), ttl=NEARBY_SEARCH_TTL)
+
+def get_gmaps_client() -> googlemaps.Client:
+    """Returns the shared, pooled Google Maps client."""
+    return get_clients().gmaps
 
-def get_gmaps_client():
-    """Initializes and returns a Google Maps client."""
-    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_MAPS_API_KEY environment variable not set.")
-    return googlemaps.Client(key=api_key)
-
-def get_tavily_client():
-    """Initializes and returns a Tavily client."""
-    api_key = os.getenv("TAVILY_API_KEY")
-    if not api_key:
-        raise ValueError("TAVILY_API_KEY environment variable not set.")
-    return TavilyClient(api_key=api_key)
-
-def calculate_business_score(business_name: str, total_ratings: int) -> int:
+def get_async_tavily_client() -> AsyncTavilyClient:
+    """Returns the shared, pooled async Tavily client."""
+    return get_clients().tavily
+
+async def get_search_popularity_score(business_name: str, deadline: Optional[float] = None) -> int:
     """
-    Calculates a score based on search popularity and number of reviews.
-    A lower score indicates a smaller, less-known business.
+    Scores how visible a business is on the web. More results imply higher popularity.
+    Errors (including asyncio.TimeoutError after ENRICHMENT_CALL_TIMEOUT or at `deadline`) are raised to the caller.
     """
-    logger.info(f"---🕵️  Calculating score for: '{business_name}'---")
-    search_popularity_score = 0
+    tavily = get_async_tavily_client()
+    # A general search for the business name. More results imply higher popularity.
+    search_query = f'"{business_name}"'
+
+    results = await call_upstream("tavily", lambda: tavily.search(
+        query=search_query,
+        max_results=5, # Check more results for a better popularity signal
+        search_depth="basic"
+    ), timeout=ENRICHMENT_CALL_TIMEOUT, deadline=deadline)
+
+    if results and results.get('results'):
+        return len(results.get('results')) * 50 # Weight search results
+    return 0
+
+async def _fetch_website(gmaps: googlemaps.Client, place_id: str, deadline: Optional[float] = None) -> Optional[str]:
+    """
+    Returns a place's website, from the cache or the Places details API.
+    Only successful lookups are cached; failures return None.
+    """
+    cached = await website_cache.aget(place_id)
+    if cached is not None:
+        return cached["website"]
+
     try:
-        tavily = get_tavily_client()
-        # A general search for the business name. More results imply higher popularity.
-        search_query = f'"{business_name}"'
-        
-        results = tavily.search(
-            query=search_query, 
-            max_results=5, # Check more results for a better popularity signal
-            search_depth="basic"
+        details = await call_upstream(
+            "gmaps", lambda: run_blocking(gmaps.place, place_id=place_id, fields=['website'], language='ro'),
+            timeout=ENRICHMENT_CALL_TIMEOUT, deadline=deadline
         )
+        website = details.get('result', {}).get('website')
+        await website_cache.aset(place_id, {"website": website})
+        return website
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out fetching details for place_id {place_id}")
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping details for place_id {place_id}: {e}")
+    except Exception as e:
+        logger.warning(f"Could not fetch details for place_id {place_id}: {e}")
+    return None
 
-        if results and results.get('results'):
-            search_popularity_score = len(results.get('results')) * 50 # Weight search results
+async def _fetch_score(business_name: str, place_id: Optional[str], total_ratings: int, deadline: Optional[float] = None) -> int:
+    """
+    Returns the business score, from the cache or a fresh popularity search.
+    Falls back to the number of reviews if the search fails.
+    """
+    cached = await score_cache.aget(place_id) if place_id else None
+    if cached is not None:
+        # The popularity part rarely changes; keep the review count up to date.
+        return cached["score"] - cached["user_ratings_total"] + total_ratings
 
+    logger.info(f"---🕵️  Calculating score for: '{business_name}'---")
+    try:
+        popularity = await get_search_popularity_score(business_name, deadline)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out calculating score for '{business_name}'")
+        return total_ratings
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping the popularity score of '{business_name}': {e}")
+        return total_ratings
     except Exception as e:
-        logger.error(f"      -> Error during score calculation for '{business_name}': {e}")
-    
-    return total_ratings + search_popularity_score
+        logger.warning(f"Could not calculate score for '{business_name}': {e}")
+        return total_ratings
+
+    score = total_ratings + popularity
+    if place_id:
+        await score_cache.aset(place_id, {"user_ratings_total": total_ratings, "score": score})
+    return score
 
-def find_local_businesses(state: Dict) -> Dict:
+async def _enrich_place(gmaps: googlemaps.Client, place: Dict[str, Any], workers: asyncio.Semaphore, deadline: Optional[float] = None) -> Business:
+    """
+    Builds a Business from a Places result, fetching its website and score concurrently.
+    Calls still running at the deadline are dropped like failed ones.
+    """
+    place_name = place.get("name")
+    place_id = place.get('place_id')
+    total_ratings = place.get('user_ratings_total', 0)
+    logger.info(f"Found business on map: {place_name}")
+
+    async with workers:
+        # Obținem detalii suplimentare, inclusiv website-ul, și calculăm scorul
+        # pe baza popularității în căutări și a numărului de recenzii.
+        website_lookup = _fetch_website(gmaps, place_id, deadline) if place_id else asyncio.sleep(0, result=None)
+        website, score = await asyncio.gather(website_lookup, _fetch_score(place_name, place_id, total_ratings, deadline))
+
+    return {
+        "name": place_name,
+        "address": place.get("vicinity"),
+        "rating": place.get("rating", 0),
+        "maps_url": f"https://www.google.com/maps/place/?q=place_id:{place_id}",
+        "place_id": place_id,
+        "website": website,
+        "score": score,
+        "location": place.get("geometry", {}).get("location"),
+    }
+
+def _nearby_cache_key(tile: str, radius: int, keyword: str) -> str:
+    normalized_keyword = " ".join(keyword.lower().split())
+    return f"{tile}|{radius}|{normalized_keyword}"
+
+def _within_radius(places: List[Dict[str, Any]], location: Dict[str, float], radius: float) -> List[Dict[str, Any]]:
+    """Keeps the places whose exact location is within `radius` meters of `location`."""
+    nearby = []
+    for place in places:
+        place_location = place.get("geometry", {}).get("location")
+        if not place_location or distance_m(location, place_location) <= radius:
+            nearby.append(place)
+    return nearby
+
+async def _search_nearby(gmaps: googlemaps.Client, user_location: Dict[str, float], search_radius: int, keyword: str) -> List[Dict[str, Any]]:
+    """
+    Returns the Places nearby-search results around the user, answered from the cached
+    searches of the user's tile or its neighbors when one of them covers the whole area.
+    """
+    tile = encode_geohash(user_location["lat"], user_location["lng"], NEARBY_TILE_PRECISION)
+    for candidate in [tile] + neighbor_tiles(tile):
+        entry = await nearby_cache.aget(_nearby_cache_key(candidate, search_radius, keyword), record_stats=False)
+        if entry and distance_m(user_location, entry["center"]) + search_radius <= entry["query_radius"]:
+            nearby_cache.record(hit=True)
+            logger.info(f"Nearby search served from cached tile '{candidate}'")
+            return _within_radius(entry["results"], user_location, search_radius)
+    nearby_cache.record(hit=False)
+
+    center = tile_center(tile)
+    query_radius = min(search_radius + math.ceil(tile_diagonal_m(tile)), MAX_PLACES_RADIUS)
+    places_result = await call_upstream("gmaps", lambda: run_blocking(
+        gmaps.places_nearby,
+        location=center,
+        keyword=keyword,
+        radius=query_radius,
+        language="ro",
+        type="clothing_store"
+    ))
+    results = places_result.get("results", [])
+    await nearby_cache.aset(
+        _nearby_cache_key(tile, search_radius, keyword),
+        {"center": center, "query_radius": query_radius, "results": results}
+    )
+    return _within_radius(results, user_location, search_radius)
+
+async def find_local_businesses(state: Dict) -> Dict:
     """
     A tool that finds local businesses using Google Maps.
+    The details and score of every place are fetched concurrently, with at most
+    ENRICHMENT_MAX_WORKERS places enriched at a time. A failed or slow call only
+    drops that piece of data, never the whole business. The enrichment calls are
+    shortened to the request's remaining budget (`state["deadline"]`).
     """
     user_query = state.get("user_query")
     user_location = state.get("user_location")
@@ -79,7 +228,7 @@ def find_local_businesses(state: Dict) -> Dict:
         # This block was moved to the graph's initialization logic
         # Gracefully handle missing API keys instead of crashing the server.
         gmaps = get_gmaps_client()
-        get_tavily_client() # We call this just to validate the key is present.
+        get_async_tavily_client() # We call this just to validate the key is present.
 
         # Refine the search keyword to prioritize smaller, local stores.
         refined_keyword = f"magazin haine local boutique {user_query}"
@@ -88,54 +237,35 @@ def find_local_businesses(state: Dict) -> Dict:
         logger.error(f"API Key Error: {e}")
         return {"businesses": [], "error": f"A required API key is not configured on the server: {e}"}
     try:
-        places_result = gmaps.places_nearby(
-            location=user_location,
-            keyword=refined_keyword,
-            radius=search_radius,
-            language="ro",
-            type="clothing_store"
-        )
-        
+        places = await _search_nearby(gmaps, user_location, search_radius, refined_keyword)
+
         # The Google Maps API returns up to 20 results per page by default, which matches the request.
         # If more were needed, we would handle pagination here using `places_result.get('next_page_token')`.
-        verified_businesses: List[Business] = []
-        for place in places_result.get("results", []):
-            place_name = place.get("name")
-            logger.info(f"Found business on map: {place_name}")
-
-            # Obținem detalii suplimentare, inclusiv website-ul
-            place_id = place.get('place_id')
-            website = None
-            total_ratings = place.get('user_ratings_total', 0)
-
-            if place_id:
-                try:
-                    # Fetch website details in a separate call
-                    details = gmaps.place(place_id=place_id, fields=['website'], language='ro')
-                    website = details.get('result', {}).get('website')
-                except Exception as e:
-                    logger.warning(f"Could not fetch details for place_id {place_id}: {e}")
-
-            # Calculăm scorul pe baza popularității în căutări și a numărului de recenzii.
-            score = calculate_business_score(place_name, total_ratings)
-
-            verified_businesses.append({
-                "name": place_name,
-                "address": place.get("vicinity"),
-                "rating": place.get("rating", 0),
-                "maps_url": f"https://www.google.com/maps/place/?q=place_id:{place.get('place_id')}",
-                "place_id": place.get('place_id'),
-                "website": website,
-                "score": score,
-            })
-
-        return {"businesses": verified_businesses}
+        workers = asyncio.Semaphore(ENRICHMENT_MAX_WORKERS)
+        verified_businesses: List[Business] = await asyncio.gather(
+            *(_enrich_place(gmaps, place, workers, search_deadline(state)) for place in places)
+        )
+
+        # Remember every business we saw, so known areas can later be served locally.
+        try:
+            await run_blocking(lambda: get_business_catalog().upsert(verified_businesses))
+        except Exception as e:
+            logger.warning(f"Could not update the local business catalog: {e}")
 
+        logger.info(
+            f"Place cache stats: website={website_cache.stats()}, score={score_cache.stats()}, "
+            f"nearby={nearby_cache.stats()}"
+        )
+        return {"businesses": list(verified_businesses)}
+
+    except CircuitOpenError as e:
+        logger.warning(f"Business search skipped: {e}")
+        return {"businesses": [], "error": str(e)}
     except Exception as e:
         logger.error(f"An error occurred in the business search tool: {e}")
         return {"businesses": [], "error": str(e)}
 
-def search_product_at_store(business_website: str, product_query: str) -> Dict:
+async def search_product_at_store(business_website: str, product_query: str) -> Dict:
     """
     A tool to search a specific store's website for a product using Tavily.
     """
@@ -144,10 +274,13 @@ def search_product_at_store(business_website: str, product_query: str) -> Dict:
         return {"results": [], "error": "Business website is not available."}
     
     try:
-        tavily = get_tavily_client()
+        tavily = get_async_tavily_client()
         # The query is already fully constructed in the graph, so we use it directly.
-        results = tavily.search(query=product_query, max_results=3)
+        results = await call_upstream("tavily", lambda: tavily.search(query=product_query, max_results=3))
         return {"results": results.get('results', [])}
+    except CircuitOpenError as e:
+        logger.warning(f"Product search on '{business_website}' skipped: {e}")
+        return {"results": [], "error": str(e)}
     except Exception as e:
         logger.error(f"An error occurred during product search: {e}")
         return {"results": [], "error": str(e)}
@@ -0,0 +1,118 @@
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from langchain_core.messages import SystemMessage
+from pydantic import BaseModel, Field
+
+from .resilience import call_upstream
+
+logger = logging.getLogger(__name__)
+
+# --- Batched Verification Configuration ---
+# "batch" verifies all candidate pages of a request in a few structured calls,
+# "per_result" asks the LLM about every page separately.
+PRODUCT_VERIFICATION_MODE = os.getenv("PRODUCT_VERIFICATION_MODE", "batch")
+# Every page excerpt is cut to this many characters before being sent.
+VERIFICATION_SNIPPET_CHARS = int(os.getenv("VERIFICATION_SNIPPET_CHARS", "800"))
+# Approximate prompt size (in tokens) of a single batched call.
+VERIFICATION_BATCH_TOKENS = int(os.getenv("VERIFICATION_BATCH_TOKENS", "6000"))
+# Verdicts below this confidence are treated as "not available".
+VERIFICATION_MIN_CONFIDENCE = float(os.getenv("VERIFICATION_MIN_CONFIDENCE", "0.6"))
+# Rough characters-per-token ratio used to stay within the budget without a tokenizer.
+CHARS_PER_TOKEN = 4
+
+class ProductVerdict(BaseModel):
+    """Whether one page excerpt offers the product for sale."""
+    id: int = Field(description="The id of the excerpt, as given in the prompt.")
+    available: bool = Field(description="True if the product seems to be available for sale on that page.")
+    confidence: float = Field(ge=0.0, le=1.0, description="How confident you are in this verdict, between 0 and 1.")
+
+class VerificationBatch(BaseModel):
+    """One verdict for every excerpt in the prompt."""
+    verdicts: List[ProductVerdict]
+
+def prepare_candidates(results: List[dict]) -> List[dict]:
+    """
+    Turns search results into numbered candidates: pages are deduplicated by URL,
+    excerpts are truncated, and pages with an identical excerpt share one candidate.
+    """
+    candidates: List[dict] = []
+    by_snippet: Dict[str, dict] = {}
+    seen_urls = set()
+    for result in results:
+        url = result.get("url")
+        if not url or url in seen_urls:
+            continue
+        seen_urls.add(url)
+        snippet = " ".join((result.get("content") or "").split())[:VERIFICATION_SNIPPET_CHARS]
+        if snippet in by_snippet:
+            by_snippet[snippet]["urls"].append(url)
+            continue
+        candidate = {"id": len(candidates) + 1, "urls": [url], "snippet": snippet, "result": result}
+        by_snippet[snippet] = candidate
+        candidates.append(candidate)
+    return candidates
+
+def chunk_candidates(candidates: List[dict], token_budget: int = VERIFICATION_BATCH_TOKENS) -> List[List[dict]]:
+    """Groups candidates so that each group's excerpts fit in the token budget."""
+    batches: List[List[dict]] = []
+    current: List[dict] = []
+    current_tokens = 0
+    for candidate in candidates:
+        tokens = (len(candidate["snippet"]) + len(candidate["urls"][0])) // CHARS_PER_TOKEN + 10
+        if current and current_tokens + tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(candidate)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def build_batch_prompt(search_keywords: str, batch: List[dict]) -> str:
+    excerpts = "\n\n".join(f"[{c['id']}] URL: {c['urls'][0]}\nText: \"{c['snippet']}\"" for c in batch)
+    return f"""
+    Below are numbered excerpts from webpages of local shops.
+    For each excerpt, decide whether the product "{search_keywords}" seems to be available for sale on that page.
+    Return exactly one verdict per excerpt id, with your confidence between 0 and 1.
+
+{excerpts}
+    """
+
+async def verify_in_batches(
+    verification_llm,
+    search_keywords: str,
+    results: List[dict],
+    fallback: Callable[[str, dict], Awaitable[Optional[str]]],
+) -> Dict[str, bool]:
+    """
+    Verifies all search results with as few structured LLM calls as the token budget allows.
+    Returns a verdict per URL. A batch whose call fails is verified with `fallback`,
+    the per-result check, instead.
+    """
+    candidates = prepare_candidates(results)
+    batches = chunk_candidates(candidates)
+    verdicts: Dict[str, bool] = {}
+
+    async def verify_batch(batch: List[dict]):
+        prompt = build_batch_prompt(search_keywords, batch)
+        try:
+            response: VerificationBatch = await call_upstream("openai", lambda: verification_llm.ainvoke([SystemMessage(content=prompt)]))
+            by_id = {v.id: v for v in response.verdicts}
+            for candidate in batch:
+                verdict = by_id.get(candidate["id"])
+                available = bool(verdict and verdict.available and verdict.confidence >= VERIFICATION_MIN_CONFIDENCE)
+                for url in candidate["urls"]:
+                    verdicts[url] = available
+        except Exception as e:
+            logger.warning(f"Batched verification failed, checking {len(batch)} results one by one: {e}")
+            urls = await asyncio.gather(*(fallback(search_keywords, c["result"]) for c in batch))
+            for candidate, verified_url in zip(batch, urls):
+                for url in candidate["urls"]:
+                    verdicts[url] = verified_url is not None
+
+    await asyncio.gather(*(verify_batch(batch) for batch in batches))
+    logger.info(f"Verified {len(results)} results ({len(candidates)} unique excerpts) in {len(batches)} batched call(s)")
+    return verdicts
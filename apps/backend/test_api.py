@@ -22,8 +22,8 @@ print(f"--- Sending request to: {API_URL} ---")
 print(f"--- Query: {user_query} ---\n")
 
 try:
-    # Send the POST request with a long timeout, as the agent can take time to think.
-    response = requests.post(API_URL, json=payload, timeout=300)
+    # The agent answers within its time budget (WEB_REQUEST_BUDGET, 30s by default), partially if needed.
+    response = requests.post(API_URL, json=payload, timeout=60)
 
     # Check if the request was successful
     # This will raise an HTTPError if the status code is 4xx or 5xx
@@ -0,0 +1,145 @@
+import os
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from twilio.base.exceptions import TwilioRestException
+
+from .clients import get_clients
+from .jobs import Job, PermanentJobError, get_job_queue
+from .shopping_agent.concurrency import run_blocking
+from .shopping_agent.resilience import call_upstream
+from .shopping_agent.metrics import track_request
+from .shopping_agent.budget import request_deadline
+from .shopping_agent.sessions import get_session_graph, session_config, expire_idle_session, delete_session
+
+logger = logging.getLogger(__name__)
+
+# --- WhatsApp Configuration ---
+WHATSAPP_QUEUE = "whatsapp"
+# Since we can't get GPS from WhatsApp, we use a default location.
+DEFAULT_LOCATION = {
+    "lat": 44.4268,  # Bucharest latitude
+    "lng": 26.1025,  # Bucharest longitude
+}
+# Messages from the same sender arriving less than this many seconds apart are answered
+# together (see JOB_GROUP_MAX_DELAY for the longest a message is held back).
+WHATSAPP_COALESCE_WINDOW = float(os.getenv("WHATSAPP_COALESCE_WINDOW", "3"))
+# How often (in seconds) a running answer checks whether the sender wrote again.
+WHATSAPP_FOLLOW_UP_POLL_INTERVAL = float(os.getenv("WHATSAPP_FOLLOW_UP_POLL_INTERVAL", "1"))
+
+def enqueue_whatsapp_message(user_query: str, from_number: str, message_sid: Optional[str] = None) -> Optional[int]:
+    """
+    Persists an incoming message for the worker pool. Twilio redelivers a webhook
+    when it is slow to answer, so messages are deduplicated on their MessageSid.
+    Returns the job id, or None for a duplicate.
+    """
+    payload = {"body": user_query, "from": from_number, "message_sid": message_sid}
+    return get_job_queue().enqueue(
+        WHATSAPP_QUEUE, payload, dedup_key=message_sid, group_key=from_number, delay=WHATSAPP_COALESCE_WINDOW
+    )
+
+def coalesced_query(payload: Dict[str, Any]) -> str:
+    """The text of a message followed by the follow-ups merged into it."""
+    return " ".join([payload["body"]] + [m["body"] for m in payload.get("merged", [])])
+
+async def _watch_for_follow_up(job: Job, stop: asyncio.Event) -> bool:
+    """
+    Returns True once a new message from the same sender has been merged into the job,
+    or False when asked to stop. Never cancelled mid-merge, so no message can be lost.
+    """
+    queue = get_job_queue()
+    while not stop.is_set():
+        if await run_blocking(queue.take_group, job):
+            return True
+        try:
+            await asyncio.wait_for(stop.wait(), WHATSAPP_FOLLOW_UP_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    return False
+
+async def run_agent(job: Job) -> str:
+    """
+    Runs the shopping agent graph in the sender's session and returns the answer.
+    A message arriving while the graph runs cancels the run, which is restarted from
+    the session state it started from, with both messages as one query.
+    """
+    thread_id = job.payload["from"]
+    graph = await get_session_graph()
+    await expire_idle_session(thread_id)
+    before = await graph.aget_state(session_config(thread_id))
+
+    # Messages queued during the coalescing window are answered by this run.
+    await run_blocking(get_job_queue().take_group, job)
+    while True:
+        user_query = coalesced_query(job.payload)
+        initial_state = {
+            "user_query": user_query,
+            "user_location": DEFAULT_LOCATION,
+            "messages": [("user", user_query)],
+            "deadline": request_deadline("whatsapp"),
+        }
+        stop = asyncio.Event()
+        run = asyncio.create_task(graph.ainvoke(initial_state, before.config))
+        follow_up = asyncio.create_task(_watch_for_follow_up(job, stop))
+        try:
+            await asyncio.wait({run, follow_up}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.set()
+            if not run.done():
+                run.cancel()
+            has_follow_up = await follow_up
+            try:
+                await run
+            except asyncio.CancelledError:
+                pass
+
+        if not has_follow_up:
+            return run.result()["messages"][-1].content
+        if not before.values:
+            # Nothing to rewind to: drop the partial checkpoints of the cancelled run.
+            await delete_session(thread_id)
+        logger.info(f"New message from {job.payload['from']} while answering, restarting with: '{coalesced_query(job.payload)}'")
+
+async def send_whatsapp_reply(to_number: str, text: str) -> None:
+    """Sends a WhatsApp message through Twilio. Client errors (4xx) are not retried."""
+    twilio_phone_number = os.getenv("TWILIO_PHONE_NUMBER")
+    if not twilio_phone_number:
+        raise PermanentJobError("TWILIO_PHONE_NUMBER is not configured in the .env file.")
+    try:
+        client = get_clients().twilio
+    except ValueError as e:
+        raise PermanentJobError(str(e)) from e
+
+    try:
+        # The Twilio client is blocking, so it runs on the bounded I/O pool. While Twilio's
+        # breaker is open the call fails fast and the job is retried later by the queue.
+        await call_upstream("twilio", lambda: run_blocking(
+            client.messages.create,
+            from_=f'whatsapp:{twilio_phone_number}',
+            body=text,
+            to=to_number
+        ))
+    except TwilioRestException as e:
+        if 400 <= e.status < 500 and e.status != 429:
+            raise PermanentJobError(f"Twilio rejected the message: {e.msg}") from e
+        raise
+
+async def process_whatsapp_message(job: Job) -> None:
+    """
+    Answers one WhatsApp message, together with the follow-ups merged into it.
+    The answer is kept in the job payload, so a retry after a failed Twilio send
+    does not run the agent again.
+    """
+    from_number = job.payload["from"]
+    logger.info(f"Processing job {job.id} (attempt {job.attempts}) for {from_number} with query: '{job.payload['body']}'")
+
+    if job.payload.get("reply") is None:
+        with track_request("whatsapp"):
+            job.payload["reply"] = await run_agent(job)
+
+    await send_whatsapp_reply(from_number, job.payload["reply"])
+    logger.info(f"Successfully sent reply to {from_number}")
+
+# Handlers run by the worker pool, by queue name.
+JOB_HANDLERS = {WHATSAPP_QUEUE: process_whatsapp_message}
@@ -0,0 +1,52 @@
+from dotenv import load_dotenv
+import os
+import sys
+import signal
+import asyncio
+import logging
+
+# --- Environment Variable Loading ---
+# Same .env file as the web app (backend/.env), whatever the working directory.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(current_dir, '.env'))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+from .clients import get_clients, close_clients
+from .shopping_agent.concurrency import run_blocking
+from .shopping_agent.intent import get_intent_classifier, INTENT_FAST_PATH_ENABLED
+from .jobs import WorkerPool, get_job_queue, JOB_WORKER_CONCURRENCY
+from .whatsapp import JOB_HANDLERS
+from .shopping_agent.sessions import close_session_store
+
+# Worker pool processing the WhatsApp messages queued by /whatsapp-webhook.
+# Run one or more of them next to the web app, from the `apps` directory:
+#   python -m backend.worker [concurrency]
+# Every process shares the queue file (JOB_QUEUE_DB_PATH), so throughput scales
+# with the number of processes, independently of the API workers.
+
+async def main(concurrency: int):
+    get_clients()
+    if INTENT_FAST_PATH_ENABLED:
+        # Trained before the first job, as in the web app.
+        await run_blocking(get_intent_classifier)
+    pool = WorkerPool(get_job_queue(), JOB_HANDLERS, concurrency=concurrency)
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, pool.stop)
+        except NotImplementedError:
+            # Not available on Windows; Ctrl+C then stops the pool without waiting for the running jobs.
+            pass
+
+    try:
+        await pool.run()
+    finally:
+        await close_session_store()
+        await close_clients()
+        logger.info("Worker pool stopped.")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else JOB_WORKER_CONCURRENCY))